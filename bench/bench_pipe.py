@@ -0,0 +1,159 @@
+"""
+bench_pipe.py
+
+Measure the analyzer cpu time to read engine output. A fake uci engine
+sends a stream of info lines, like a real engine most of them are
+currmove and hashfull lines, and mea searches one position with it.
+
+python bench/bench_pipe.py --lines 1000000 --multipv 1
+
+Use --baseline to compare with the mea.py of another version. Versions
+without search_uci_position are run with their run_uci_engine on one
+position, their time includes the engine start.
+
+python bench/bench_pipe.py --baseline old/mea.py
+"""
+
+
+import os
+import sys
+import time
+import tempfile
+import contextlib
+import argparse
+import subprocess
+import importlib.util
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import mea
+
+
+FEN = 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1'
+
+
+def get_info_lines(num_lines, multipv):
+    """ Returns engine output with num_lines info lines and bestmove """
+    lines = []
+    depth = 0
+    while len(lines) < num_lines:
+        depth = min(60, depth + 1)
+        for i in range(multipv):
+            lines.append('info depth %d seldepth %d multipv %d score cp %d '
+                         'nodes %d nps 1500000 hashfull 120 tbhits 0 time %d '
+                         'pv e7e5 g1f3 b8c6 f1b5 a7a6' % (depth, depth + 4,
+                         i + 1, 30 - i, depth * 1000, depth))
+        for n in range(1, 9):
+            lines.append('info depth %d currmove e7e5 currmovenumber %d' % (depth, n))
+        lines.append('info nodes %d nps 1500000 hashfull 120 tbhits 0 time %d' % (
+                depth * 1000, depth))
+    lines = lines[0:num_lines] + ['bestmove e7e5 ponder g1f3']
+
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def run_engine(num_lines, multipv):
+    """ Fake uci engine, it sends num_lines info lines after go """
+    output = get_info_lines(num_lines, multipv)
+    out = sys.stdout.buffer
+    for line in sys.stdin:
+        if line.startswith('uci') and not line.startswith('ucinewgame'):
+            out.write(b'uciok\n')
+        elif line.startswith('isready'):
+            out.write(b'readyok\n')
+        elif line.startswith('go'):
+            out.write(output)
+        elif line.startswith('quit'):
+            break
+        out.flush()
+
+
+def load_module(fn):
+    spec = importlib.util.spec_from_file_location('mea_baseline', fn)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+def get_engine_cmd(num_lines, multipv):
+    return [sys.executable, __file__, '--engine', '--lines', str(num_lines),
+            '--multipv', str(multipv)]
+
+
+def bench_run(module, num_lines, multipv):
+    """ Returns analyzer cpu time in seconds of run_uci_engine in module
+        with one position, for versions before search_uci_position
+    """
+    fd, epd_output_fn = tempfile.mkstemp(suffix='.epd')
+    os.close(fd)
+    fen_list = [[FEN, 'e5=10', 'bench', FEN, [('e5', 10)]]]
+    a = module.Analyze(get_engine_cmd(num_lines, multipv), fen_list, 1, 10**9,
+                       1, 64, 'uci', 'bench', 0, 1, 2, epd_output_fn, multipv,
+                       None, 'bench', False, True)
+
+    # The summary of the run is not shown
+    with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f):
+        t = time.process_time()
+        a.run_uci_engine()
+        t = time.process_time() - t
+    os.remove(epd_output_fn)
+    assert a.get_result()[1] == 1, a.get_result()
+
+    return t
+
+
+def bench(module, num_lines, multipv):
+    """ Returns analyzer cpu time in seconds of a search in module """
+    module.logger.setLevel('WARNING')
+    if not hasattr(module.Analyze, 'search_uci_position'):
+        return bench_run(module, num_lines, multipv)
+
+    a = module.Analyze('bench', [], 1, 10**9, 1, 64, 'uci', 'bench', 0, 1, 2,
+                       None, multipv, None, 'bench', False, True)
+    cmd = get_engine_cmd(num_lines, multipv)
+
+    # Versions before binary mode pipe read in text mode
+    if hasattr(module, 'EngineOutput'):
+        p = subprocess.Popen(cmd, bufsize=module.ENGINE_PIPE_BUFSIZE,
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        a.engine_output = module.EngineOutput(p.stdout)
+    else:
+        p = subprocess.Popen(cmd, bufsize=1, stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE, universal_newlines=True)
+
+    t = time.process_time()
+    result = a.search_uci_position(p, FEN, 10**9)
+    t = time.process_time() - t
+    a.quit_engine(p)
+    assert result['bm'] == 'e5', result
+
+    return t
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Engine pipe read benchmark')
+    parser.add_argument('--lines', default=1000000, type=int,
+                        help='number of info lines, default=1000000')
+    parser.add_argument('--multipv', default=1, type=int,
+                        help='number of pv lines per depth, default=1')
+    parser.add_argument('--baseline', help='mea.py of another version to compare')
+    parser.add_argument('--engine', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.engine:
+        run_engine(args.lines, args.multipv)
+        return
+
+    per_million = 1000000 / args.lines
+    print('info lines          : %d' % args.lines)
+    print('multipv             : %d' % args.multipv)
+    if args.baseline:
+        t = bench(load_module(args.baseline), args.lines, args.multipv)
+        print('baseline cpu (s)    : %0.3f per million lines' % (t * per_million))
+    t = bench(mea, args.lines, args.multipv)
+    print('mea cpu (s)         : %0.3f per million lines' % (t * per_million))
+
+
+if __name__ == '__main__':
+    main()
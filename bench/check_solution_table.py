@@ -0,0 +1,140 @@
+"""
+check_solution_table.py
+
+Check the array scoring of SolutionTable against the scoring of Analyze
+one position at a time. Engine moves are drawn at random from the
+solution moves of the epd, moves that are not solutions and positions
+that are not tried.
+
+python bench/check_solution_table.py --epd epd/otsv4-mea.epd --engines 100
+
+Exits with an error if the rescore totals, the results by group or the
+bootstrap rates are not as expected.
+"""
+
+
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import mea
+
+
+def get_random_moves(fen_list, rnd):
+    """ Returns an engine move per position, None if not tried """
+    moves = []
+    for fen_line in fen_list:
+        r = rnd.random()
+        if r < 0.05:
+            moves.append(None)
+        elif r < 0.2 or not fen_line[4]:
+            moves.append('Kxx')
+        else:
+            moves.append(rnd.choice(fen_line[4])[0])
+
+    return moves
+
+
+def score_moves(fen_list, moves, group_keys):
+    """ Returns top1, score, max score and tried of moves by update_score
+        and the results by group
+    """
+    a = mea.Analyze('check', fen_list, len(fen_list), 1, 1, 1, 'uci', 'check',
+                    0, 1, 2, None, 1, None, 'check', False, True)
+    a.group_keys = [k for k, m in zip(group_keys, moves) if m is not None]
+    for fen_line, m in zip(fen_list, moves):
+        if m is not None:
+            a.num_pos_tried += 1
+            a.update_score(fen_line[4], m)
+
+    return a.get_result()[1:], a.get_group_result()
+
+
+def check_rescore(table, fen_list, engine_moves, group_keys):
+    """ Rescore totals and results by group are the same as update_score """
+    choices = np.stack([table.choice_indices(moves) for moves in engine_moves])
+    counts = table.rescore(choices)
+    groups, masks = table.group_masks(group_keys)
+    group_counts = table.rescore(choices, masks)
+
+    for i, moves in enumerate(engine_moves):
+        totals, group_result = score_moves(fen_list, moves, group_keys)
+        assert [int(c[i]) for c in counts] == totals, (i, totals)
+        rows = [[g] + [int(c[i, j]) for c in group_counts]
+                for j, g in enumerate(groups)]
+        assert [r for r in rows if r[4]] == group_result, (i, group_result)
+
+
+def check_with_points(table, engine_moves):
+    """ A top move only scheme gives max points for top1 moves only """
+    choices = np.stack([table.choice_indices(moves) for moves in engine_moves])
+    top_table = table.with_points(lambda p: p * (p == p[:, :1]))
+    top1, score, max_score, _ = table.rescore(choices)
+    _, top_score, top_max_score, _ = top_table.rescore(choices)
+
+    assert (top_max_score == max_score).all()
+    assert (top_score <= score).all()
+    points, _ = table.engine_points(choices)
+    assert (top_score >= (points * (choices == 0)).sum(axis=1)).all()
+    assert top1.sum() > 0
+
+
+def check_bootstrap(table, engine_moves, samples, prefix):
+    """ Bootstrap rates have a shape of (engines, samples), are within
+        0 and 1, are the same for the same seed and are around the rate
+        of all positions
+    """
+    choices = np.stack([table.choice_indices(moves) for moves in engine_moves])
+    _, score, max_score, _ = table.rescore(choices)
+
+    for mask in (None, table.subset_mask(prefix)):
+        if mask is not None:
+            _, score, max_score, _ = table.rescore(choices, mask[None, :])
+            score, max_score = score[:, 0], max_score[:, 0]
+        rates = table.bootstrap(choices, samples, mask, seed=1)
+        assert rates.shape == (len(engine_moves), samples), rates.shape
+        assert (rates >= 0).all() and (rates <= 1).all()
+        assert (rates == table.bootstrap(choices, samples, mask, seed=1)).all()
+
+        rate = score / np.maximum(max_score, 1)
+        low, high = np.percentile(rates, [0.5, 99.5], axis=1)
+        assert ((low <= rate) & (rate <= high)).all(), (rate, low, high)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SolutionTable check')
+    parser.add_argument('--epd', default=str(Path(__file__).resolve().parents[1] /
+                        'epd' / 'Openings200-mea.epd'), help='epd with c0 solutions')
+    parser.add_argument('--engines', default=20, type=int,
+                        help='number of random engines, default=20')
+    parser.add_argument('--samples', default=1000, type=int,
+                        help='number of bootstrap samples, default=1000')
+    parser.add_argument('--seed', default=1, type=int, help='default=1')
+    args = parser.parse_args()
+
+    mea.logger.setLevel('WARNING')
+    rnd = random.Random(args.seed)
+    fen_list, _, _ = mea.create_epd_list(args.epd)
+    group_keys = [rnd.choice(['a', 'b', 'c', None]) for _ in fen_list]
+    engine_moves = [get_random_moves(fen_list, rnd) for _ in range(args.engines)]
+    prefix = next((fen_line[2] for fen_line in fen_list if fen_line[2]), '')
+
+    t = time.perf_counter()
+    table = mea.SolutionTable(fen_list)
+    check_rescore(table, fen_list, engine_moves, group_keys)
+    check_with_points(table, engine_moves)
+    check_bootstrap(table, engine_moves, args.samples, prefix)
+
+    print('positions           : %d' % len(fen_list))
+    print('engines             : %d' % args.engines)
+    print('check time (s)      : %0.3f' % (time.perf_counter() - t))
+    print('SolutionTable is ok')
+
+
+if __name__ == '__main__':
+    main()
@@ -9,14 +9,41 @@ Analyzes epd file having multiple solution moves with points
 
 import os
 import subprocess
+import copy
+import shutil
 from pathlib import Path
 import logging
 import time
 import re
+import math
+import json
+import struct
+import mmap
+import sys
+from array import array
 import csv
 import argparse
+import itertools
+import random
+import tempfile
+import queue
+import concurrent.futures
+import threading
+import http.server
 
 import chess
+import chess.polyglot
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 
 __version__ = '1.3'
@@ -28,6 +55,17 @@ APP_DESC = 'Analyzes epd file having multiple solution moves with points'
 APP_NAME_VERSION = APP_NAME + ' v' + __version__
 
 
+# Time budget, fraction of the budget for the first search of all positions
+TIME_BUDGET_PROBE_FRACTION = 0.25
+TIME_BUDGET_MIN_PROBE_MS = 20
+
+# Engine output is read in binary mode with this buffer size
+ENGINE_PIPE_BUFSIZE = 1 << 16
+
+# Generate mode, cp score gap per point lost by a move
+GENERATE_SCALE = 2.0
+
+
 # Create logger
 logger = logging.getLogger('mea')
 logger.setLevel(logging.DEBUG)
@@ -71,8 +109,11 @@ def sort_key_score(item):
     return item[5]
 
 
-def csv_to_html(csvfn, htmlfn, epdfn):
-    """ Creates table in html format from csv file """
+def csv_to_html(csvfn, htmlfn, epdfn, group_csvfn=None, sweep_csvfn=None):
+    """ Creates table in html format from csv file, results by group are
+        added as one table per group if group_csvfn is given and the
+        scaling table if sweep_csvfn is given
+    """
     # Get epd filename alone, not including path
     epd_fn_only = epdfn.split('\\')
     varlen = len(epd_fn_only)
@@ -81,11 +122,16 @@ def csv_to_html(csvfn, htmlfn, epdfn):
     else:
         epd_fn_name = epdfn
     
-    # Open the CSV file for reading
-    reader = csv.reader(open(csvfn))
+    # Create the HTML file for output from the CSV file
+    with open(csvfn, 'r') as csvfile, open(htmlfn, 'w') as htmlfile:
+        write_html_tables(csvfile, htmlfile, epd_fn_name, group_csvfn,
+                          sweep_csvfn)
 
-    # Create the HTML file for output
-    htmlfile = open(htmlfn, 'w')
+
+def write_html_tables(csvfile, htmlfile, epd_fn_name, group_csvfn=None,
+                      sweep_csvfn=None):
+    """ Write the html page with the result table of csvfile """
+    reader = csv.reader(csvfile)
 
     # initialize rownum variable
     rownum = 0
@@ -136,16 +182,257 @@ def csv_to_html(csvfn, htmlfn, epdfn):
     # write </table> tag
     htmlfile.write('</table>\n')
 
+    section = 'B'
+    if group_csvfn is not None and os.path.isfile(group_csvfn):
+        write_group_tables_in_html(htmlfile, group_csvfn)
+        section = 'C'
+
+    if sweep_csvfn is not None and os.path.isfile(sweep_csvfn):
+        htmlfile.write('<br><strong>%s. Scaling:</strong><br><br>\n' % section)
+        htmlfile.write('<table id="t01">')
+        with open(sweep_csvfn, 'r') as f:
+            for i, row in enumerate(csv.reader(f)):
+                tag = 'th' if i == 0 else 'td'
+                htmlfile.write('<tr>')
+                for column in row:
+                    htmlfile.write('<%s>%s</%s>' % (tag, column, tag))
+                htmlfile.write('</tr>')
+        htmlfile.write('</table>\n')
+
     htmlfile.write('</body>\n')
     htmlfile.write('</html>\n')
 
 
+def write_group_tables_in_html(htmlfile, group_csvfn):
+    """ Write one table per group from group csv file, sorted by score rate """
+    with open(group_csvfn, 'r') as f:
+        rows = list(csv.reader(f))
+    header, rows = rows[0], rows[1:]
+    group_col = header.index('Group')
+    rate_col = header.index('ScoreRate')
+
+    groups = {}
+    for row in rows:
+        groups.setdefault(row[group_col], []).append(row)
+
+    htmlfile.write('<br><strong>B. Results by group:</strong><br>\n')
+    for group in sorted(groups):
+        htmlfile.write('<br>Group: %s<br>\n' % group)
+        htmlfile.write('<table id="t01">')
+        htmlfile.write('<tr>')
+        for i, column in enumerate(header):
+            if i != group_col:
+                htmlfile.write('<th>' + column + '</th>')
+        htmlfile.write('</tr>')
+        for row in sorted(groups[group], key=lambda r: float(r[rate_col]), reverse=True):
+            htmlfile.write('<tr>')
+            for i, column in enumerate(row):
+                if i != group_col:
+                    htmlfile.write('<td>' + column + '</td>')
+            htmlfile.write('</tr>')
+        htmlfile.write('</table>\n')
+
+
+class Progress():
+    """ Progress of one analysis, updated by Analyze after each position and
+        read by MetricsExporter from other threads
+    """
+    def __init__(self, labels, total):
+        self.labels = labels  # {'engine': name, ...}
+        self.total = total
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.last_update = self.start_time
+        self.done, self.top1_cnt, self.total_score, self.max_score = 0, 0, 0, 0
+        self.nps, self.engine_starts = 0, 0
+
+    def update(self, a, nps=None):
+        """ Copy the counters of Analyze a """
+        with self.lock:
+            self.done = a.num_pos_tried
+            self.top1_cnt = a.best_cnt
+            self.total_score = a.total_score
+            self.max_score = a.max_score
+            self.engine_starts = a.num_engine_starts
+            if nps:
+                self.nps = nps
+            self.last_update = time.time()
+
+    def get_metrics(self):
+        """ Returns a list of (metric name, value) """
+        with self.lock:
+            now = time.time()
+            elapsed = now - self.start_time
+            pos_per_sec = self.done / elapsed if elapsed > 0 else 0.0
+            remaining = self.total - self.done
+            eta = remaining / pos_per_sec if pos_per_sec > 0 else -1
+            top1_rate, score_rate = get_rates(self.top1_cnt, self.done,
+                                              self.total_score, self.max_score)
+            return [('mea_positions', self.total),
+                    ('mea_positions_done', self.done),
+                    ('mea_positions_per_second', pos_per_sec),
+                    ('mea_eta_seconds', eta),
+                    ('mea_elapsed_seconds', elapsed),
+                    ('mea_top1_rate', top1_rate),
+                    ('mea_score_rate', score_rate),
+                    ('mea_engine_nps', self.nps),
+                    ('mea_engine_starts_total', self.engine_starts),
+                    ('mea_last_update_timestamp_seconds', self.last_update)]
+
+
+class MetricsExporter():
+    """ Exposes the progress of analyses in Prometheus text format on a local
+        http port and/or in a file, from threads that do not block the analysis
+    """
+    def __init__(self):
+        self.progresses = []
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.server = None
+        self.writer = None
+
+    def add(self, progress):
+        with self.lock:
+            self.progresses.append(progress)
+
+        return progress
+
+    def render(self):
+        """ Returns the metrics of all progresses in Prometheus text format """
+        with self.lock:
+            progresses = list(self.progresses)
+
+        samples = {}
+        for progress in progresses:
+            labels = ','.join('%s="%s"' % (k, str(v).replace('"', "'"))
+                              for k, v in progress.labels.items())
+            for name, value in progress.get_metrics():
+                samples.setdefault(name, []).append('%s{%s} %s' % (name, labels, value))
+
+        lines = []
+        for name, values in samples.items():
+            lines.append('# TYPE %s %s' % (
+                    name, 'counter' if name.endswith('_total') else 'gauge'))
+            lines.extend(values)
+
+        return '\n'.join(lines) + '\n'
+
+    def serve_http(self, port, host='127.0.0.1'):
+        """ Serve metrics at http://host:port/metrics """
+        exporter = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = exporter.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logger.info('Metrics at http://%s:%d/metrics' % (host, port))
+
+    def write_file(self, fn):
+        """ Replace fn with the metrics, readers never see a partial file """
+        tmp_fn = fn + '.tmp'
+        with open(tmp_fn, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_fn, fn)
+
+    def write_file_periodically(self, fn, interval=5.0):
+        """ Write metrics file every interval seconds until stop() """
+        def write():
+            self.write_file(fn)
+            while not self.stop_event.wait(interval):
+                self.write_file(fn)
+            self.write_file(fn)
+
+        self.writer = threading.Thread(target=write, daemon=True)
+        self.writer.start()
+
+    def stop(self):
+        """ Write the last metrics and stop the server """
+        self.stop_event.set()
+        if self.writer is not None:
+            self.writer.join()
+        if self.server is not None:
+            self.server.shutdown()
+
+
+class EngineOutput():
+    """ Engine output in bytes, the pipe is read in chunks of up to size
+        bytes that end at a newline
+    """
+    def __init__(self, f, size=ENGINE_PIPE_BUFSIZE):
+        self.f = f
+        self.size = size
+        self.buf = b''  # complete lines from the pipe
+        self.pos = 0  # position of the first line in buf that is not read
+        self.rest = b''  # incomplete last line from the pipe
+
+    def fill(self):
+        """ Read the pipe if all lines are read, returns False at the
+            end of output
+        """
+        while self.pos >= len(self.buf):
+            data = self.f.read1(self.size)
+            if not data:
+                self.buf, self.pos, self.rest = self.rest, 0, b''
+                return len(self.buf) > 0
+            data = self.rest + data
+            end = data.rfind(b'\n') + 1
+            self.buf, self.pos, self.rest = data[0:end], 0, data[end:]
+
+        return True
+
+    def read_chunk(self):
+        """ Returns the lines that are not read as one bytes, b'' at the
+            end of output
+        """
+        if not self.fill():
+            return b''
+        chunk = self.buf[self.pos:] if self.pos else self.buf
+        self.pos = len(self.buf)
+
+        return chunk
+
+    def __iter__(self):
+        """ Yields lines without the newline """
+        while self.fill():
+            end = self.buf.find(b'\n', self.pos)
+            if end < 0:
+                end = len(self.buf)
+            line = self.buf[self.pos:end]
+            self.pos = end + 1
+            yield line
+
+
+def get_position_difficulty(result):
+    """ Returns the time weight of a position from its probe search, an
+        unstable pv, a changing score or a close second best move need
+        more time
+    """
+    weight = 1.0 + result['pv_changes']
+    weight += min(result['score_swing'], 100) / 50.0
+    if result['score_gap'] is not None and result['score_gap'] < 30:
+        weight += 1.0
+
+    return weight
+
+
 class Analyze():     
     def __init__(self, engine, fen_list, max_epd_cnt, movetime, num_threads,
                  num_hash, proto, name, san, stmode, protover, epd_output_fn,
-                 multipv, eoption, input_epd_name, infinite, runenginefromcwd):
+                 multipv, eoption, input_epd_name, infinite, runenginefromcwd,
+                 group_keys=None, affinity=None, numa_node=None, pos_keys=None,
+                 progress=None, timebudget=None):
         self.engine = engine
-        self.fen_list = fen_list # [fen, solutions, id]
+        self.fen_list = fen_list # [fen, solutions, id, epd, solution_points]
         self.max_epd_cnt = max_epd_cnt
         self.movetime = movetime
         self.num_threads = num_threads
@@ -167,10 +454,86 @@ class Analyze():
         self.depth = -1
         self.infinite = infinite
         self.runenginefromcwd = runenginefromcwd
+        self.pos_points = []  # points of engine move per position
+        self.pos_top1 = []  # True if engine move is the first solution move
+        self.pos_choices = []  # engine move in san per position
+        self.group_keys = group_keys  # group name per position or None
+        self.group_stats = {}  # {group: [top1cnt, score, maxscore, numpostried]}
+        self.affinity = affinity  # cpu numbers where the engine will run
+        self.numa_node = numa_node  # numa node of affinity cpus or None
+
+        # Position key per fen line, positions with the same key are searched
+        # once, None if positions are not deduplicated
+        self.pos_keys = pos_keys if pos_keys is not None else [None] * len(fen_list)
+        self.progress = progress  # Progress for metrics or None
+        self.pos_results = []  # result dict per position for export
+        self.timebudget = timebudget  # ms for all positions or None
+        if timebudget is not None and proto == 'xboard':
+            raise ValueError('timebudget is only supported for uci engines')
+        self.num_engine_starts = 0
+        self.engine_output = None  # EngineOutput of the running engine
+        self.num_search = 0  # positions searched by the engine
+        self.start_time = None  # perf_counter time when the engine is ready
 
     def command(self, p, com):
         logger.debug(f'>> {com}')
-        p.stdin.write(f'{com}\n')
+        p.stdin.write(f'{com}\n'.encode())
+        p.stdin.flush()
+
+    def start_engine_process(self):
+        """ Start engine process and place it on self.affinity cpus """
+        # Run from engine's folder by default and not from mea's folder
+        folder = Path(self.engine).parents[0] if not self.runenginefromcwd else None
+
+        # Pin the engine before it starts so that all its threads inherit
+        # the cpus, bind its memory to the numa node if numactl is available
+        engine_cmd = self.engine
+        is_pinned = self.affinity is None
+        if self.affinity is not None:
+            cpus = format_cpus(self.affinity)
+            if self.numa_node is not None and shutil.which('numactl') is not None:
+                engine_cmd = ['numactl', f'--physcpubind={cpus}',
+                              f'--membind={self.numa_node}', self.engine]
+                is_pinned = True
+            elif shutil.which('taskset') is not None:
+                engine_cmd = ['taskset', '-c', cpus, self.engine]
+                is_pinned = True
+        
+        # Binary mode, lines are only decoded when they are needed
+        p = subprocess.Popen(engine_cmd, bufsize=ENGINE_PIPE_BUFSIZE,
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT, cwd=folder)
+        self.engine_output = EngineOutput(p.stdout)
+        if not is_pinned:
+            self.set_affinity(p)
+        if self.affinity is not None:
+            logger.info('Engine placement: %s' % self.get_placement())
+        self.num_engine_starts += 1
+        if self.progress is not None:
+            self.progress.update(self)
+
+        return p
+
+    def set_affinity(self, p):
+        """ Pin engine process to the cpus in self.affinity after it is
+            started, used if taskset is not installed, threads that the
+            engine created before are not pinned
+        """
+        if not hasattr(os, 'sched_setaffinity'):
+            logger.warning('cpu affinity is not supported on this platform')
+            return
+        logger.warning('taskset is not found, engine threads may not be pinned')
+        os.sched_setaffinity(p.pid, self.affinity)
+
+    def get_placement(self):
+        """ Returns cpus and numa node of the engine as text """
+        if self.affinity is None:
+            return 'not pinned'
+        placement = 'cpus ' + format_cpus(self.affinity)
+        if self.numa_node is not None:
+            placement += ' node %d' % self.numa_node
+
+        return placement
 
     def run(self):
         """ Run engine to analyze epd """
@@ -179,26 +542,15 @@ class Analyze():
         else:
             self.run_uci_engine()
 
-    def update_score(self, fen_line, movesan):
-        """ Update score of the engine """
-        bests = fen_line # Nd2=10, h3=7, Be2=6
-        best_list = bests.split(',')
-        
+    def update_score(self, solution_points, movesan):
+        """ Update score of the engine, returns the points of movesan """
         top_move_cnt = 0                    
         this_move_score = 0
+        is_top1 = False
         
-        # Loop thru the solution moves ['Nd2=10', 'h3=7', 'Be2=6']
-        for n in best_list:
+        # Loop thru the solution moves [('Nd2', 10), ('h3', 7), ('Be2', 6)]
+        for m, move_score in solution_points:
             top_move_cnt += 1
-            # Deal with 2 equal symbols, b1=Q=77
-            if n.count('=') == 2:
-                m = n.split('=')[0] + '=' +  n.split('=')[1] # Get move
-                m = m.strip()
-                move_score = int(n.split('=')[2])  # Get score
-            else:
-                m = n.split('=')[0]  # Get move
-                m = m.strip()
-                move_score = int(n.split('=')[1])  # Get score
                 
             # Assume that the first solution move has the highest score
             if top_move_cnt == 1:
@@ -208,16 +560,34 @@ class Analyze():
             if m == movesan:
                 this_move_score = move_score
                 if top_move_cnt == 1:
+                    is_top1 = True
                     self.best_cnt += 1
                     logger.info('Top 1 move!!')
                 self.total_score += move_score
                 break
+
+        # Update the stats of the group where this position belongs
+        if self.group_keys is not None:
+            group = self.group_keys[len(self.pos_points)]
+            if group is not None:
+                stats = self.group_stats.setdefault(group, [0, 0, 0, 0])
+                stats[0] += int(is_top1)
+                stats[1] += this_move_score
+                stats[2] += solution_points[0][1] if solution_points else 0
+                stats[3] += 1
+
+        # Save per position points for rescoring and statistics
+        self.pos_points.append(this_move_score)
+        self.pos_top1.append(is_top1)
+        self.pos_choices.append(movesan)
             
         # Get pct of score after thie epd so far
         logger.info('Score for this test: %d' % this_move_score)
         pct = float(self.total_score)/self.max_score if self.max_score > 0 else 0.0 
         logger.info('Total Score update: %d / %d (%0.3f)'\
                        % (self.total_score, self.max_score, pct))
+
+        return this_move_score
             
     def mate_distance_to_value(self, d):
         """ Returns value in cp given distance to mate """
@@ -232,23 +602,19 @@ class Analyze():
     def get_result(self):
         return [self.name, self.best_cnt, self.total_score,
                 self.max_score, self.num_pos_tried]
+
+    def get_group_result(self):
+        """ Returns [[group, top1cnt, score, maxscore, numpostried], ...] """
+        return [[group] + stats for group, stats in sorted(self.group_stats.items())]
         
-    def run_uci_engine(self):
-        """ Start engine """
-        logger.info('Run engine %s' % self.name)
-        
-        # Run from engine's folder by default and not from mea's folder
-        folder = Path(self.engine).parents[0] if not self.runenginefromcwd else None
-        
-        # Python 3.7
-        p = subprocess.Popen(self.engine, bufsize=1, stdin=subprocess.PIPE,
-                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                             universal_newlines=True, cwd=folder)
+    def start_uci_engine(self):
+        """ Start uci engine, set its options and return the process """
+        p = self.start_engine_process()
         
         self.command(p, 'uci')
         
-        for eline in iter(p.stdout.readline, ''):
-            line = eline.strip()
+        for eline in self.engine_output:
+            line = eline.decode('utf-8', 'replace').strip()
             logger.debug('<< %s' % line)
             if 'uciok' in line:
                 break
@@ -277,195 +643,385 @@ class Analyze():
         
         # Prepare engine.
         self.command(p, 'isready')                
-        for eline in iter(p.stdout.readline, ''):
-            aa = eline.strip()
-            if 'readyok' in aa:
+        for eline in self.engine_output:
+            if b'readyok' in eline:
                 logger.debug('<< readyok')
                 break
 
-        line_cnt = 0
-        t1 = time.perf_counter()        
+        return p
 
-        for fen_line in self.fen_list:
-            logger.info('\n')
-            logger.info('Pos %d' % (line_cnt+1))
-            logger.info('EPD: %s' % fen_line[3])
-            logger.info('id %s' % fen_line[2])
-            logger.info('FEN: %s' % fen_line[0])
-            logger.info('Solutions: %s' % fen_line[1])
-            
-            search_info = {}
-                    
-            line_cnt += 1
+    def quit_engine(self, p):
+        """ Send quit and kill the engine if it does not quit """
+        self.command(p, 'quit')
+        
+        # Terminate engine process when engine does not quit after quit command        
+        try:
+            p.communicate(timeout=5)
+        except subprocess.TimeoutExpired:
+            logger.warning('Engine is terminated by kill()')
+            p.kill()
+            p.communicate()
 
-            # Console progress
-            print('epd %d / %d \r' %(line_cnt, self.max_epd_cnt)),
-            
-            depth_info = 0
-            score_cp_info = -32000
-            fen = fen_line[0]
-            movesan = None
-
-            # Prepare the engine.
-            self.command(p, 'ucinewgame')
-
-            self.command(p, 'isready')
-            for eline in iter(p.stdout.readline, ''):
-                if 'readyok' in eline:
-                    logger.debug('<< readyok')
-                    break
+    def search_uci_position(self, p, fen, movetime):
+        """ Search fen and return a dict with bm in san, ce, acd,
+            mpv data and elapsed time in ms
+        """
+        search_info = {}
+        depth_info = 0
+        score_cp_info = -32000
+        nps_info = 0
+        movesan = None
+        last_pv_move, pv_changes = None, 0
+        depth_scores = {}  # {depth: score} of the first pv
+        board = chess.Board(fen)
+        san_moves = {}  # {uci move: san move} of the pv moves
+        stop_time_margin_ms = max(10, min(100, movetime//4))
+
+        # Prepare the engine.
+        self.command(p, 'ucinewgame')
+
+        self.command(p, 'isready')
+        for eline in self.engine_output:
+            if b'readyok' in eline:
+                logger.debug('<< readyok')
+                break
 
-            # Send the position.
-            self.command(p, f'position fen {fen}')
+        # Send the position.
+        self.command(p, f'position fen {fen}')
 
-            # Send isready again to make sure we are in sync with the engine.
-            self.command(p, 'isready')
-            for eline in iter(p.stdout.readline, ''):
-                if 'readyok' in eline:
-                    logger.debug('<< readyok')
-                    break
-            
-            go_start = time.perf_counter()
-            if self.depth > 0:
-                if self.movetime <= 0:
-                    self.command(p, f'go depth {self.depth}')
-                else:
-                    self.command(p, f'go movetime {self.movetime} depth {self.depth}')
-            # Send go infinite for engines that does not support movetime and/or depth properly
-            elif self.infinite:
-                self.command(p, 'go infinite')
+        # Send isready again to make sure we are in sync with the engine.
+        self.command(p, 'isready')
+        for eline in self.engine_output:
+            if b'readyok' in eline:
+                logger.debug('<< readyok')
+                break
+        
+        go_start = time.perf_counter()
+        if self.depth > 0:
+            if movetime <= 0:
+                self.command(p, f'go depth {self.depth}')
             else:
-                self.command(p, f'go movetime {self.movetime}')
+                self.command(p, f'go movetime {movetime} depth {self.depth}')
+        # Send go infinite for engines that does not support movetime and/or depth properly
+        elif self.infinite:
+            self.command(p, 'go infinite')
+        else:
+            self.command(p, f'go movetime {movetime}')
+
+        stop_sent = False
+        stop_time = self.get_stop_time(go_start, movetime, stop_time_margin_ms)
+        max_depth = 1
+
+        # Parse engine output, only pv and bestmove lines are decoded
+        for chunk in iter(self.engine_output.read_chunk, b''):
+            for eline in chunk.split(b'\n'):
+                pv_index = eline.find(b' pv ')
+                if pv_index < 0:
+                    if not eline.startswith(b'bestmove'):
+                        continue
+                    logger.debug('<< %s' % eline.decode('utf-8', 'replace').strip())
+                    bm = eline.split()[1].decode()
+                    bm = bm.lower()
 
-            stop_sent = False
-            max_depth = 1
+                    # Convert uci bestmove to san bestmove
+                    movesan = board.san(chess.Move.from_uci(bm)) 
+                    
+                    logger.info('elapsed(ms) since go: {:0.0f}'.format(
+                            (time.perf_counter() - go_start) * 1000))
+                    logger.info('bestmove: {}'.format(movesan))
+                    break
 
-            # Parse engine output
-            for eline in iter(p.stdout.readline, ''):
-                line = eline.strip()
-                
-                if ('depth ' in line and ' pv ' in line \
-                    and not 'upperbound' in line \
-                    and not 'lowerbound' in line) or 'bestmove' in line:
-                    logger.debug('<< %s' % line)
+                # Pv is the last info field, only its first move is decoded
+                end = eline.find(b' ', pv_index + 4)
+                tokens = eline[0:end if end >= 0 else None].decode(
+                        'utf-8', 'replace').split()
+
+                # Get the info fields of this pv line
+                is_bound = 'upperbound' in tokens or 'lowerbound' in tokens
+                pv_move = tokens[-1] if tokens[-1] != 'pv' else None
+                depth, mpv_info, score, is_cp = None, None, None, False
+                if 'depth' in tokens:
+                    depth = int(tokens[tokens.index('depth') + 1])
+                if 'multipv' in tokens:
+                    mpv_info = int(tokens[tokens.index('multipv') + 1])
+                if 'score' in tokens:
+                    i = tokens.index('score')
+                    if tokens[i+1] == 'mate':
+                        score = self.mate_distance_to_value(int(tokens[i+2]))
+                    elif tokens[i+1] == 'cp':
+                        score, is_cp = int(tokens[i+2]), True
+
+                if depth is not None and not is_bound and logger.isEnabledFor(logging.DEBUG):
+                    logger.debug('<< %s' % eline.decode('utf-8', 'replace').strip())
+
+                # Track changes of the first pv for the time budget
+                if (pv_move is not None and depth is not None and score is not None
+                        and not is_bound and mpv_info in (None, 1)):
+                    if last_pv_move is not None and pv_move != last_pv_move:
+                        pv_changes += 1
+                    last_pv_move = pv_move
+                    if is_cp:
+                        depth_scores[depth] = score
 
                 if self.multipv >= 2:
-                    if ('score' in line and 'depth' in line and 'pv' in line
-                            and not 'upperbound' in line
-                            and not 'lowerbound' in line
-                            and 'multipv' in line):
-                        if 'score mate' in line:
-                            distance_to_mate = int(line.split('mate')[1].split()[0].strip())
-                            score_cp_info = self.mate_distance_to_value(distance_to_mate)
-                        elif 'cp' in line:
-                            score_cp_info = int(line.split('cp')[1].split()[0].strip())
-                            
-                        depth_info = int(line.split('depth')[1].split()[0])
-                        mpv_info = int(line.split('multipv')[1].split()[0])
+                    if (score is not None and depth is not None and not is_bound
+                            and mpv_info is not None and pv_move is not None):
+                        score_cp_info = score
+                        depth_info = depth
                         key = f'd{depth_info}_mpv{mpv_info}'
-
-                        pv_info_first_move = line.split(' pv')[1].strip().split()[0]
-                        tmp_board = chess.Board(fen)
                         
                         # Convert move from uci to san move format
-                        pv_move_san = tmp_board.san(chess.Move.from_uci(pv_info_first_move))
+                        pv_move_san = san_moves.get(pv_move)
+                        if pv_move_san is None:
+                            pv_move_san = board.san(chess.Move.from_uci(pv_move))
+                            san_moves[pv_move] = pv_move_san
                         
                         dict_value = {key: {'score': score_cp_info, 'depth': depth_info, 'bm': pv_move_san}}
                         search_info.update(dict_value)
                         max_depth = max(depth_info, max_depth)
                                 
-                elif ('depth' in line or 'score' in line) and 'pv' in line:
-                    # Get depth, assume depth first before seldepth
-                    if 'depth' in line:
-                        depth_info = int(line.split('depth')[1].split()[0])
+                else:
+                    # Get depth and score
+                    if depth is not None:
+                        depth_info = depth
                         max_depth = max(depth_info, max_depth)
-                    
-                    # Get score
-                    if 'score' in line:
-                        if 'score mate' in line:
-                            distance_to_mate = int(line.split('mate')[1].split()[0].strip())
-                            score_cp_info = self.mate_distance_to_value(distance_to_mate)
-                        elif 'cp' in line:
-                            score_cp_info = int(line.split('cp')[1].split()[0].strip())
-
-                if 'bestmove' in line:
-                    self.num_pos_tried += 1
-                    bm = line.split()[1]
-                    bm = bm.lower()
+                    if score is not None:
+                        score_cp_info = score
+
+            # Last nps of the chunk, it can be in lines that are not decoded
+            i = chunk.rfind(b' nps ')
+            if i >= 0:
+                nps_info = int(chunk[i+5:i+25].split()[0])
+
+            if movesan is not None:
+                break
+
+            if not stop_sent and time.perf_counter() >= stop_time:
+                stop_sent = True
+                self.command(p, 'stop')
+
+        elapsed_ms = (time.perf_counter() - go_start) * 1000
+
+        # Clean mpv result, save the last depth with complete mpv as
+        # there are engines that do not complete the mpv at certain depth.
+        fdata = []
+        if self.multipv >= 2:
+            fdata = get_mpv_data(search_info, max_depth)
 
-                    # Convert uci bestmove to san bestmove
-                    tmp_board = chess.Board(fen)
-                    movesan = tmp_board.san(chess.Move.from_uci(bm)) 
-                    
-                    logger.info('elapsed(ms) since go: {:0.0f}'.format(
-                            (time.perf_counter() - go_start) * 1000))
-                    logger.info('bestmove: {}'.format(movesan))
-                    
-                    self.update_score(fen_line[1], movesan)
-                    break
-                
-                tdiff = (time.perf_counter() - go_start) * 1000
-
-                # Send stop early if we re using go infinite
-                if not stop_sent and self.infinite and tdiff > 2*self.movetime//3:
-                    stop_sent = True
-                    self.command(p, 'stop')
-
-                # There are engines that does not follow movetime so we stop it
-                if not stop_sent and tdiff - self.stop_time_margin_ms >= self.movetime:
-                    stop_sent = True
-                    self.command(p, 'stop')
-
-            # Clean mpv result, save the last depth with complete mpv as
-            # there are engines that do not complete the mpv at certain depth.
-            fdata = []
-            if self.multipv >= 2:
-                fdata = get_mpv_data(search_info, max_depth)
-                    
-            epd = ' '.join(fen_line[0].split()[0:4])
-            
             # Debug
-            if self.multipv >= 2:
-                for k, v in search_info.items():
-                    logger.info('multipv {} = {}'.format(k, v))
+            for k, v in search_info.items():
+                logger.info('multipv {} = {}'.format(k, v))
+
+        # Score change between the last 2 depths and score gap of the first
+        # 2 pv when in multipv
+        score_swing, score_gap = 0, None
+        depths = sorted(depth_scores)
+        if len(depths) >= 2:
+            score_swing = abs(depth_scores[depths[-1]] - depth_scores[depths[-2]])
+        if len(fdata) >= 2:
+            score_gap = fdata[0][1]['score'] - fdata[1][2]['score']
+
+        return {'bm': movesan, 'ce': score_cp_info, 'acd': depth_info,
+                'mpv': fdata, 'elapsed': elapsed_ms, 'nps': nps_info,
+                'pv_changes': pv_changes, 'score_swing': score_swing,
+                'score_gap': score_gap}
+
+    def get_stop_time(self, go_start, movetime, stop_time_margin_ms):
+        """ Returns perf_counter time when stop is sent to the engine """
+        # Send stop early if we re using go infinite
+        if self.infinite:
+            return go_start + (2*movetime//3) / 1000
+
+        # There are engines that does not follow movetime so we stop it
+        return go_start + (movetime + stop_time_margin_ms) / 1000
+
+    def search_with_time_budget(self, p):
+        """ Search unique positions within self.timebudget ms and return
+            {position key: result}
+
+        All positions are first searched with a short probe, the remaining
+        time is then given to positions in proportion to their difficulty.
+        Positions whose share is less than the probe time keep the probe
+        result and their share goes to the others.
+        """
+        unique = {}  # {position key: fen}
+        for i, fen_line in enumerate(self.fen_list):
+            unique.setdefault(self.get_search_key(i), fen_line[0])
+        if not unique:
+            return {}
+
+        probe_ms = max(TIME_BUDGET_MIN_PROBE_MS, int(
+                self.timebudget * TIME_BUDGET_PROBE_FRACTION / len(unique)))
+        if probe_ms * len(unique) > self.timebudget:
+            logger.warning('Time budget of %d ms is less than the minimum '
+                           '%d ms probe of %d positions' % (
+                           self.timebudget, probe_ms, len(unique)))
+        logger.info('Time budget: %d ms, positions: %d, probe: %d ms' % (
+                self.timebudget, len(unique), probe_ms))
+
+        t1 = time.perf_counter()
+        probes = {}
+        for key, fen in unique.items():
+            probes[key] = self.search_uci_position(p, fen, probe_ms)
+        used_ms = (time.perf_counter() - t1) * 1000
+
+        # Engine communication time per search on top of the movetime
+        overhead_ms = max(0.0, used_ms / len(unique) - probe_ms)
+        weights = {key: get_position_difficulty(r) for key, r in probes.items()}
+
+        active = set(unique)
+        while active:
+            remaining_ms = self.timebudget - used_ms - overhead_ms * len(active)
+            total_weight = sum(weights[k] for k in active)
+            small = {k for k in active
+                     if remaining_ms * weights[k] / total_weight < probe_ms}
+            if not small:
+                break
+            active -= small
+
+        results = {}
+        for key, fen in unique.items():
+            alloc_ms = 0
+            if key in active:
+                alloc_ms = int(remaining_ms * weights[key] / total_weight)
+            r = probes[key]
+            logger.info('Time allocation fen %s: pv changes %d, score swing %d, '
+                        'score gap %s, weight %0.2f, probe %d ms, search %d ms' % (
+                        fen, r['pv_changes'], r['score_swing'], r['score_gap'],
+                        weights[key], probe_ms, alloc_ms))
+            results[key] = r
+            if alloc_ms > 0:
+                results[key] = self.search_uci_position(p, fen, alloc_ms)
+
+        return results
+
+    def get_search_key(self, i):
+        """ Returns the key of fen line i, lines with the same key are
+            searched once
+        """
+        key = self.pos_keys[i]
+
+        return ('pos', i) if key is None else key
+
+    def save_position_result(self, fen_line, result, points):
+        """ Keep the result of a position for export """
+        key = self.pos_keys[len(self.pos_results)]
+        if key is None:
+            key = get_position_key(fen_line[0]) or 0
+        self.pos_results.append({
+                'key': key,
+                'epd': epd_key(fen_line[0]), 'id': fen_line[2],
+                'pos': len(self.pos_results) + 1, 'bm': result['bm'],
+                'ce': result['ce'], 'acd': result['acd'], 'points': points,
+                'max_points': fen_line[4][0][1] if fen_line[4] else 0,
+                'is_top1': int(self.pos_top1[len(self.pos_results)]),
+                'multipv': [[v[i+1]['bm'], v[i+1]['score'], v[i+1]['depth']]
+                            for i, v in enumerate(result['mpv'])],
+                'elapsed_ms': result['elapsed'], 'nps': result['nps']})
+
+    def write_epd_output(self, fen, result, line_cnt):
+        """ Save epd with bm, ce and acd """
+        if self.epd_output_fn is None:
+            return
+
+        epd = ' '.join(fen.split()[0:4])
             
-            # Save epd with ce and acd
-            # (1) Multipv is 1
-            if self.multipv <= 1:
+        # (1) Multipv is 1
+        if self.multipv <= 1:
+            with open(self.epd_output_fn, 'a') as h:
+                h.write('%s bm %s; ce %d; acd %d;\n' % (
+                        epd, result['bm'], result['ce'], result['acd']))
+            logger.info('%s bm %s; ce %d; acd %d;' % (epd, result['bm'],
+                                            result['ce'], result['acd']))
+        else:
+            for i, v in enumerate(result['mpv']):
+                id_operand = self.input_epd_name + ' pos ' + str(line_cnt) + ' MultiPV=' + str(i+1)
                 with open(self.epd_output_fn, 'a') as h:
-                    h.write('%s bm %s; ce %d; acd %d;\n' % (
-                            epd, movesan, score_cp_info, depth_info))
-                logger.info('%s bm %s; ce %d; acd %d;' % (epd, movesan,
-                                                score_cp_info, depth_info))
-            else:
-                for i, v in enumerate(fdata):
-                    id_operand = self.input_epd_name + ' pos ' + str(line_cnt) + ' MultiPV=' + str(i+1)
-                    with open(self.epd_output_fn, 'a') as h:
-                        h.write('%s id \"%s\"; bm %s; ce %d; acd %d;\n' % (
-                                epd, id_operand, v[i+1]['bm'], v[i+1]['score'],
-                                v[i+1]['depth']))
-                    logger.info('%s id \"%s\"; bm %s; ce %d; acd %d;' % (
+                    h.write('%s id \"%s\"; bm %s; ce %d; acd %d;\n' % (
                             epd, id_operand, v[i+1]['bm'], v[i+1]['score'],
                             v[i+1]['depth']))
+                logger.info('%s id \"%s\"; bm %s; ce %d; acd %d;' % (
+                        epd, id_operand, v[i+1]['bm'], v[i+1]['score'],
+                        v[i+1]['depth']))
+
+    def iter_positions(self):
+        """ Analyze fen_list and yield the result of each position, the
+            engine is started with the first position and quit when all
+            positions are analyzed or the iteration is closed
+        """
+        if self.proto == 'xboard':
+            p = self.start_xb_engine()
+            search = self.search_xb_position
+        else:
+            p = self.start_uci_engine()
+            search = self.search_uci_position
 
-        # Quit engine when all FEN's are analyzed.
-        self.command(p, 'quit')
-        
-        # Terminate engine process when engine does not quit after quit command        
+        self.start_time = time.perf_counter()
+        self.num_search = 0
+        searched = {}  # {position key: result} of searched positions
         try:
-            p.communicate(timeout=5)
-        except subprocess.TimeoutExpired:
-            logger.warning('Engine is terminated by kill()')
-            p.kill()
-            p.communicate()
+            # Results of positions searched within the time budget
+            budget_results = {}
+            if self.timebudget is not None:
+                budget_results = self.search_with_time_budget(p)
+                self.num_search = len(budget_results)
+
+            for line_cnt, fen_line in enumerate(self.fen_list, 1):
+                logger.info('\n')
+                logger.info('Pos %d' % line_cnt)
+                logger.info('EPD: %s' % fen_line[3])
+                logger.info('id %s' % fen_line[2])
+                logger.info('FEN: %s' % fen_line[0])
+                logger.info('Solutions: %s' % fen_line[1])
+
+                # Search only the first of the duplicate positions
+                key = self.get_search_key(line_cnt-1)
+                result = searched.get(key)
+                if result is None:
+                    if key in budget_results:
+                        result = budget_results[key]
+                    else:
+                        result = search(p, fen_line[0], self.movetime)
+                        self.num_search += 1
+                    searched[key] = result
+                else:
+                    logger.info('Duplicate position, bestmove: {}'.format(result['bm']))
+
+                    # No engine time is spent on a duplicate
+                    result = dict(result, elapsed=0)
+
+                self.num_pos_tried += 1
+                points = self.update_score(fen_line[4], result['bm'])
+                self.save_position_result(fen_line, result, points)
+                if self.proto == 'xboard':
+                    self.write_xb_epd_output(fen_line[0], result)
+                else:
+                    self.write_epd_output(fen_line[0], result, line_cnt)
+                if self.progress is not None:
+                    self.progress.update(self, result['nps'])
+
+                yield self.pos_results[-1]
+        finally:
+            # Quit engine when all FEN's are analyzed.
+            self.quit_engine(p)
+
+    def run_uci_engine(self):
+        """ Start engine """
+        logger.info('Run engine %s' % self.name)
+        
+        for line_cnt, _ in enumerate(self.iter_positions(), 1):
+            # Console progress
+            print('epd %d / %d \r' %(line_cnt, self.max_epd_cnt)),
+        t1 = self.start_time
+        num_search = self.num_search
 
         t2 = time.perf_counter()
 
         # Check analysis time anomalies
-        expectedMaxTime = self.movetime * self.max_epd_cnt  # ms
+        expectedMaxTime = self.timebudget or self.movetime * num_search  # ms
         ActualElapsedTime = (t2 - t1) * 1000  # ms
         timeMarginPerPos = max(50, min(200, self.movetime//4))  # ms
-        timeMargin = self.max_epd_cnt * timeMarginPerPos  # ms
+        timeMargin = num_search * timeMarginPerPos  # ms
         
         if self.depth <= -1:
             if (ActualElapsedTime <= expectedMaxTime + timeMargin) and\
@@ -495,16 +1051,69 @@ class Analyze():
         print('MarginTime/pos   : %0.1fs' %(float(timeMarginPerPos)/1000))
         print('MarginTime       : %0.1fs' %(float(timeMargin)/1000))
 
-    def run_xb_engine(self):
-        """ Start engine """
-        logger.info('Run engine %s' % self.name)
+    def search_xb_position(self, p, fen, movetime):
+        """ Search fen and return a dict with bm in san and elapsed time
+            in ms, other fields have their default values
+        """
+        movesan = None
         
-        folder = Path(self.engine).parents[0] if not self.runenginefromcwd else None
+        self.command(p, 'new')
+        self.command(p, 'force')            
+        self.command(p, f'setboard {fen}')
+
+        # Use st
+        if self.stmode:
+            if movetime < 1000:
+                self.command(p, f'st {movetime/1000.0:0.1f}')
+            else:
+                self.command(p, f'st {movetime/1000.0:0.0f}')
+        # Use level
+        else:
+            period = 40
+            tpm_ms = movetime  # ms
+            tpm_s = period * tpm_ms/1000  # sec
+            m, s = divmod(tpm_s, 60)
+            if s == 0:
+                self.command(p, f'level {period} {m} 0')                    
+                self.command(p, f'time {period*tpm_ms/10}')  # in centisec
+            else:
+                # EXchess does not like m:n notation for min:sec in level
+                if 'exchess' in self.name.lower():
+                    self.command(p, f'level {period} {max(1, m)} 0')               
+                    self.command(p, f'time {period*tpm_ms/10}')
+                else:
+                    self.command(p, f'level {period} {m}:{s} 0')
+                    self.command(p, f'time {period*tpm_ms/10}')
         
-        # Python 3.7
-        p = subprocess.Popen(self.engine, bufsize=1, stdin=subprocess.PIPE,
-                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                             universal_newlines=True, cwd=folder)
+        go_start = time.perf_counter()
+        self.command(p, 'go')
+
+        # Parse engine output
+        for eline in self.engine_output:
+            line = eline.decode('utf-8', 'replace').strip()
+            logger.debug('<< %s' % (line))
+            if 'move' in line and len(line.split()) == 2:
+                bm = line.split()[1]
+                bm = bm.strip()
+
+                if self.san:
+                    movesan = bm
+                else:
+                    # Convert uci bestmove to san bestmove
+                    tmp_board = chess.Board(fen)
+                    movesan = tmp_board.san(chess.Move.from_uci(bm))
+                
+                logger.info('elapsed(ms) since go: {:0.0f}'.format(
+                        (time.perf_counter() - go_start) * 1000))
+                logger.info('bestmove: {}'.format(movesan))
+                break
+
+        return {'bm': movesan, 'ce': -32000, 'acd': 0, 'mpv': [],
+                'elapsed': (time.perf_counter() - go_start) * 1000, 'nps': 0}
+
+    def start_xb_engine(self):
+        """ Start xboard engine and return the process """
+        p = self.start_engine_process()
         
         self.command(p, 'xboard')
 
@@ -512,8 +1121,8 @@ class Analyze():
         if self.protover == 2:
             self.command(p, 'protover 2')
 
-            for eline in iter(p.stdout.readline, ''):
-                line = eline.strip()
+            for eline in self.engine_output:
+                line = eline.decode('utf-8', 'replace').strip()
                 logger.debug('<< %s' % line)
                 if 'done=1' in line:                    
                     break
@@ -523,101 +1132,33 @@ class Analyze():
         self.command(p, 'hard')
         self.command(p, 'easy')
 
-        line_cnt = 0
-        t1 = time.perf_counter()
+        return p
 
-        for fen_line in self.fen_list:
-            logger.info('\n')
-            logger.info('Pos %d' %(line_cnt+1))
-            logger.info('EPD: %s' % fen_line[3])
-            logger.info('id %s' %(fen_line[2]))
-            logger.info('FEN: %s' %(fen_line[0]))
-            logger.info('Solutions: %s' %(fen_line[1]))
-                    
-            line_cnt += 1
+    def write_xb_epd_output(self, fen, result):
+        """ Save epd with bm """
+        # (1) Multipv is 1
+        if self.multipv == 1 and self.epd_output_fn is not None:
+            epd = ' '.join(fen.split()[0:4]).strip()
+            with open(self.epd_output_fn, 'a') as h:
+                h.write('%s bm %s;\n' % (epd, result['bm']))
 
+    def run_xb_engine(self):
+        """ Start engine """
+        logger.info('Run engine %s' % self.name)
+        
+        for line_cnt, _ in enumerate(self.iter_positions(), 1):
             # Console progress
             print('epd %d / %d \r' %(line_cnt, self.max_epd_cnt)),
-            
-            # depth = 0
-            fen = fen_line[0]
-            
-            self.command(p, 'new')
-            self.command(p, 'force')            
-            self.command(p, f'setboard {fen}')
-
-            # Use st
-            if self.stmode:
-                if self.movetime < 1000:
-                    self.command(p, f'st {self.movetime/1000.0:0.1f}')
-                else:
-                    self.command(p, f'st {self.movetime/1000.0:0.0f}')
-            # Use level
-            else:
-                period = 40
-                tpm_ms = self.movetime  # ms
-                tpm_s = period * tpm_ms/1000  # sec
-                m, s = divmod(tpm_s, 60)
-                if s == 0:
-                    self.command(p, f'level {period} {m} 0')                    
-                    self.command(p, f'time {period*tpm_ms/10}')  # in centisec
-                else:
-                    # EXchess does not like m:n notation for min:sec in level
-                    if 'exchess' in self.name.lower():
-                        self.command(p, f'level {period} {max(1, m)} 0')               
-                        self.command(p, f'time {period*tpm_ms/10}')
-                    else:
-                        self.command(p, f'level {period} {m}:{s} 0')
-                        self.command(p, f'time {period*tpm_ms/10}')
-            
-            go_start = time.perf_counter()
-            self.command(p, 'go')
-
-            # Parse engine output
-            for eline in iter(p.stdout.readline, ''):
-                line = eline.strip()
-                logger.debug('<< %s' % (line))
-                if 'move' in line and len(line.split()) == 2:
-                    self.num_pos_tried += 1
-                    bm = line.split()[1]
-                    bm = bm.strip()
-
-                    if self.san:
-                        movesan = bm
-                    else:
-                        # Convert uci bestmove to san bestmove
-                        tmp_board = chess.Board(fen)
-                        movesan = tmp_board.san(chess.Move.from_uci(bm))
-                    
-                    logger.info('elapsed(ms) since go: {:0.0f}'.format(
-                            (time.perf_counter() - go_start) * 1000))
-                    logger.info('bestmove: {}'.format(movesan))
-
-                    self.update_score(fen_line[1], movesan)
-                    break
-                
-            # (1) Multipv is 1
-            if self.multipv == 1:
-                epd = ' '.join(fen.split()[0:4]).strip()
-                with open(self.epd_output_fn, 'a') as h:
-                    h.write('%s bm %s;\n' % (epd, movesan))
-
-        self.command(p, 'quit')
-        
-        try:
-            p.communicate(timeout=5)
-        except subprocess.TimeoutExpired:
-            logger.warning('Engine is terminated by kill()')
-            p.kill()
-            p.communicate()
+        t1 = self.start_time
+        num_search = self.num_search
 
         t2 = time.perf_counter()
 
         # Check analysis time anomalies
-        expectedMaxTime = self.movetime * self.max_epd_cnt  # ms
+        expectedMaxTime = self.movetime * num_search  # ms
         ActualElapsedTime = (t2 - t1) * 1000  # ms
         timeMarginPerPos = max(50, min(200, self.movetime//4))  # ms
-        timeMargin = self.max_epd_cnt * timeMarginPerPos  # ms
+        timeMargin = num_search * timeMarginPerPos  # ms
         
         # winboard/xboard engine        
         if (ActualElapsedTime <= expectedMaxTime + timeMargin) and\
@@ -680,88 +1221,559 @@ def get_mpv_data(search_info, max_depth):
     return fdata
 
 
-def create_epd_list(epd_fn):
+def parse_solutions(solutions):
+    """ Convert solutions string to a list of (move, points)
+
+    'Nd2=10, h3=7, b1=Q=6' -> [('Nd2', 10), ('h3', 7), ('b1=Q', 6)]
+    """
+    solution_points = []
+    for n in solutions.split(','):
+        # Deal with 2 equal symbols, b1=Q=77
+        m, move_score = n.rsplit('=', 1)
+        solution_points.append((m.strip(), int(move_score)))
+
+    return solution_points
+
+
+EPD_INDEX_MAGIC = b'MEAIDX1\n'
+
+
+def build_epd_line_offsets(mm):
+    """ Returns an array of the start offset of each line in mm and the
+        end offset of the last line
+    """
+    offsets = array('Q')
+    size = len(mm)
+    pos = 0
+    while pos < size:
+        offsets.append(pos)
+        nl = mm.find(b'\n', pos)
+        pos = size if nl == -1 else nl + 1
+    offsets.append(size)
+
+    return offsets
+
+
+def get_epd_line_offsets(epd_fn, mm):
+    """ Returns line offsets of epd_fn from the index file [epd_fn].idx,
+        the index is built and saved if it is missing or out of date
+    """
+    idx_fn = epd_fn + '.idx'
+    st = os.stat(epd_fn)
+    header = struct.Struct('<QQQ')  # file size, mtime in ns, number of offsets
+
+    try:
+        with open(idx_fn, 'rb') as f:
+            if f.read(len(EPD_INDEX_MAGIC)) == EPD_INDEX_MAGIC:
+                size, mtime_ns, count = header.unpack(f.read(header.size))
+                if size == st.st_size and mtime_ns == st.st_mtime_ns:
+                    offsets = array('Q')
+                    offsets.fromfile(f, count)
+                    return offsets
+    except (OSError, EOFError, struct.error):
+        pass
+
+    logger.info('Build line index of {}'.format(epd_fn))
+    offsets = build_epd_line_offsets(mm)
+    try:
+        with open(idx_fn, 'wb') as f:
+            f.write(EPD_INDEX_MAGIC)
+            f.write(header.pack(st.st_size, st.st_mtime_ns, len(offsets)))
+            offsets.tofile(f)
+    except OSError:
+        logger.warning('Cannot save line index {}'.format(idx_fn))
+
+    return offsets
+
+
+def iter_epd_lines(epd_fn, start=None, end=None, stride=1, shard=None):
+    """ Yield (line number, line) of the selected lines of epd_fn, the file
+        is read from start to end if no selection is given, otherwise
+        only the selected lines are read thru mmap and the line index
+    """
+    if start is None and end is None and stride == 1 and shard is None:
+        with open(epd_fn, 'r') as f:
+            for i, line in enumerate(f, 1):
+                yield i, line
+        return
+
+    with open(epd_fn, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offsets = get_epd_line_offsets(epd_fn, mm)
+            num_lines = len(offsets) - 1
+            lines = range(max(1, start or 1) - 1, min(num_lines, end or num_lines), stride)
+            if shard is not None:
+                k, n = shard
+                lines = lines[k-1::n]
+            for i in lines:
+                yield i + 1, mm[offsets[i]:offsets[i+1]].decode('utf-8', errors='replace')
+
+
+def parse_epd_line(epd_line, require_solutions=True):
+    """ Returns [fen, solutions, id, orig_epd_line, solution_points] of
+        epd_line or None if it can not be used
+
+    Lines without c0 solutions are included if require_solutions is False.
+    """
+    epd_line = epd_line.strip()
+    epd = ' '.join(epd_line.split()[0:4])
+
+    # Get solution line for epd with multiple good moves
+    solutions = None
+    try:
+        # STS format
+        # [pcs] w - - bm g5; id "epd id"; c0 "g5=10, Bd4=4, Kg8=4, Rd8=3";
+        solutions = re.search('c0\s\"(.*?)\";', epd_line).group(1)
+    except:
+        if require_solutions or not epd:
+            logger.warning('Problem reading c0 field in epd: {}'.format(epd_line))
+            logger.warning('This position is not included.')
+            return None
+        solutions = ''
+
+    # Tony epd format
+    # [pcs] w - - bm Kf2; c0 "positional scores are: Kf2=7, a4=3"; id "tony.pos.15";
+    if ':' in solutions:
+        solutions = solutions.split(':')[1]
+    solutions = solutions.strip() # Nd2=10, h3=7, Be2=6
+    
+    if solutions is None:
+        logger.warning('The following epd has no solution pts. epd: {}'.format(epd_line))
+        logger.warning('This position is not included.')
+        return None
+
+    # Check if epd has hmvc. If there is, add it to the FEN.
+    # r3r1k1/1p2qpp1/1bp2n1p/2n1pP2/p5P1/B6P/PPPNQPB1/R2R2K1 b - - bm e4; hmvc 60;
+    # hmvc = half-move clock
+    # fmvn = full-move number
+    hmvc, fmvn = 0, 1
+    try:
+        hmvc = re.search('hmvc\s(.*?);', epd_line).group(1)
+    except AttributeError:
+        pass
+
+    # r3r1k1/1p2qpp1/1bp2n1p/2n1pP2/p5P1/B6P/PPPNQPB1/R2R2K1 b - - 60 1            
+    fen = f'{epd} {hmvc} {fmvn}'
+
+    # Get id
+    epd_id = None
+    try:
+        epd_id = re.search('id\s\"(.*?)\";', epd_line).group(1)
+    except:
+        pass
+
+    try:
+        solution_points = parse_solutions(solutions) if solutions else []
+    except ValueError:
+        logger.warning('Problem reading solution points in epd: {}'.format(epd_line))
+        logger.warning('This position is not included.')
+        return None
+
+    logger.info('solutions: {}'.format(solutions))
+
+    return [fen, solutions, epd_id, epd_line, solution_points]
+
+
+def create_epd_list(epd_fn, start=None, end=None, stride=1, shard=None,
+                    require_solutions=True):
     """ Read epd file and return a list in a format
-        [fen, solutions, id, orig_epd_line]
+        [fen, solutions, id, orig_epd_line, solution_points]
+
+    Lines without c0 solutions are included if require_solutions is False.
+
+    start, end: 1-based line numbers, end is included
+    stride: read every stride line from start
+    shard: (k, n), read the k-th of n shards of the selected lines
     """
     fen_data = []
     num_good_epd_line = 0
     num_epd_line = 0
     
-    with open(epd_fn, 'r') as f:
-        for line in f:                
-            epd_line = line.strip()
-            epd = ' '.join(epd_line.split()[0:4])
-            num_epd_line += 1
-            
-            logger.info('EPD position: {}'.format(num_epd_line))
-            logger.info('EPD: {}'.format(epd_line))
+    for line_num, line in iter_epd_lines(epd_fn, start, end, stride, shard):
+        num_epd_line += 1
+        
+        logger.info('EPD position: {}'.format(line_num))
+        logger.info('EPD: {}'.format(line.strip()))
 
-            # Get solution line for epd with multiple good moves
-            solutions = None
-            try:
-                # STS format
-                # [pcs] w - - bm g5; id "epd id"; c0 "g5=10, Bd4=4, Kg8=4, Rd8=3";
-                solutions = re.search('c0\s\"(.*?)\";', epd_line).group(1)
-            except:
-                logger.warning('Problem reading c0 field in epd: {}'.format(epd_line))
-                logger.warning('This position is not included.')
+        fen_line = parse_epd_line(line, require_solutions)
+        if fen_line is not None:
+            fen_data.append(fen_line)
+            num_good_epd_line += 1
+
+    return fen_data, num_good_epd_line, num_epd_line
+
+
+def read_group_file(group_fn):
+    """ Read side-car group file with lines id,group and return {id: group} """
+    group_map = {}
+    with open(group_fn, 'r') as f:
+        for row in csv.reader(f):
+            if len(row) >= 2 and not row[0].startswith('#'):
+                group_map[row[0].strip()] = row[1].strip()
+
+    return group_map
+
+
+def create_group_keys(fen_list, groupprefix=False, groupregex=None, group_map=None):
+    """ Returns the group of each position from its id, or None
+
+    group_map : {id: group} from read_group_file()
+    groupregex: regex or compiled pattern, group is the first group of the
+                match or the whole match
+    groupprefix: group is the id without the trailing number,
+                 "STS(v1.0) Undermine.001" -> "STS(v1.0) Undermine"
+    """
+    pattern = re.compile(groupregex) if groupregex else None
+    group_keys = []
+    for fen_line in fen_list:
+        epd_id, group = fen_line[2], None
+        if epd_id is not None:
+            if group_map is not None:
+                group = group_map.get(epd_id)
+            elif pattern is not None:
+                m = pattern.search(epd_id)
+                if m is not None:
+                    group = m.group(1) if pattern.groups else m.group(0)
+            elif groupprefix:
+                group = re.sub(r'[\s._-]*\d+$', '', epd_id) or None
+        group_keys.append(group)
+
+    return group_keys
+
+
+def get_position_key(fen):
+    """ Returns zobrist hash of fen, move counters are not part of it and
+        ep square is only included if there is a legal ep capture
+    """
+    try:
+        return chess.polyglot.zobrist_hash(chess.Board(fen))
+    except ValueError:
+        logger.warning('Invalid fen: {}'.format(fen))
+        return None
+
+
+def plan_unique_positions(fen_list):
+    """ Returns the position key of each fen line and the number of
+        lines that are duplicates of an earlier line
+    """
+    pos_keys = [get_position_key(fen_line[0]) for fen_line in fen_list]
+    seen = set()
+    num_duplicates = 0
+    for i, key in enumerate(pos_keys):
+        if key is None:
+            continue
+        if key in seen:
+            num_duplicates += 1
+            logger.info('Pos {} id {} is a duplicate'.format(i+1, fen_list[i][2]))
+        seen.add(key)
+
+    return pos_keys, num_duplicates
+
+
+def epd_key(epd):
+    """ Returns pieces, side, castling and ep fields of fen or epd """
+    return ' '.join(epd.split()[0:4])
+
+
+def read_epd_output(epd_out_fn):
+    """ Read epd output of mea and return a dict {epd_key: bm}
+
+    Only the MultiPV=1 line is used from a multipv epd output.
+    """
+    bm_index = {}
+    with open(epd_out_fn, 'r') as f:
+        for line in f:
+            epd_line = line.strip()
+            if not epd_line:
                 continue
 
-            # Tony epd format
-            # [pcs] w - - bm Kf2; c0 "positional scores are: Kf2=7, a4=3"; id "tony.pos.15";
-            if ':' in solutions:
-                solutions = solutions.split(':')[1]
-            solutions = solutions.strip() # Nd2=10, h3=7, Be2=6
-            
-            if solutions is None:
-                logger.warning('The following epd has no solution pts. epd: {}'.format(epd_line))
-                logger.warning('This position is not included.')
+            mpv = re.search(r'MultiPV=(\d+)', epd_line)
+            if mpv is not None and int(mpv.group(1)) != 1:
                 continue
 
-            # Check if epd has hmvc. If there is, add it to the FEN.
-            # r3r1k1/1p2qpp1/1bp2n1p/2n1pP2/p5P1/B6P/PPPNQPB1/R2R2K1 b - - bm e4; hmvc 60;
-            # hmvc = half-move clock
-            # fmvn = full-move number
-            hmvc, fmvn = 0, 1
             try:
-                hmvc = re.search('hmvc\s(.*?);', epd_line).group(1)
+                bm = re.search(r'bm\s(.*?);', epd_line).group(1).strip()
             except AttributeError:
-                pass
+                logger.warning('Problem reading bm field in epd: {}'.format(epd_line))
+                continue
 
-            # r3r1k1/1p2qpp1/1bp2n1p/2n1pP2/p5P1/B6P/PPPNQPB1/R2R2K1 b - - 60 1            
-            fen = f'{epd} {hmvc} {fmvn}'
+            bm_index.setdefault(epd_key(epd_line), bm)
 
-            # Get id
-            epd_id = None
-            try:
-                epd_id = re.search('id\s\"(.*?)\";', epd_line).group(1)
-            except:
-                pass
+    return bm_index
 
-            logger.info('solutions: {}'.format(solutions))
-            fen_data.append([fen, solutions, epd_id, epd_line])
-            num_good_epd_line += 1
 
-    return fen_data, num_good_epd_line, num_epd_line
+def get_engine_name_from_output(epd_out_fn, epd_names):
+    """ Get engine name from epd output filename [epd name]_[engine name].epd
+        or [epd name]_multipv[n]_[engine name]_[time]_epd.epd
+
+    epd_names: names of the epd files the output may be created from, the
+               whole filename is the name if it has none of them
+    """
+    name = Path(epd_out_fn).stem
+    for epd_name in epd_names:
+        for r in ((' ', '_'), ('/', '_'), ('\\', '_')):
+            epd_name = epd_name.replace(*r)
+        if name.startswith(epd_name + '_'):
+            name = name[len(epd_name) + 1:]
+            break
+    else:
+        logger.warning('Epd name of {} is not known, the filename is the '
+                       'engine name'.format(epd_out_fn))
+
+    m = re.match(r'multipv\d+_(.*)_(mt\d+ms|tb[\d.]+s)_epd$', name)
+
+    return name if m is None else m.group(1)
+
+
+def report_changed_positions(fen_list, base_fen_list, engine_names, engine_moves):
+    """ Log and print positions whose solution points differ from base_fen_list
+        and the points of each engine before and after the change
+    """
+    base_index = {}
+    for fen_line in base_fen_list:
+        base_index.setdefault(epd_key(fen_line[0]), fen_line)
+
+    changed = []
+    matched = set()  # keys of base positions that are in fen_list
+    for i, fen_line in enumerate(fen_list):
+        key = epd_key(fen_line[0])
+        base_line = base_index.get(key)
+        if base_line is not None:
+            matched.add(key)
+        if base_line is not None and base_line[4] == fen_line[4]:
+            continue
+
+        changed.append(i)
+        old_solutions = 'new position' if base_line is None else base_line[1]
+        msg = 'Pos {} id {}: {} -> {}'.format(i+1, fen_line[2], old_solutions, fen_line[1])
+        logger.info(msg)
+        print(msg)
+
+        old_points = {} if base_line is None else dict(reversed(base_line[4]))
+        new_points = dict(reversed(fen_line[4]))
+        for name, moves in zip(engine_names, engine_moves):
+            movesan = moves[i]
+            if movesan is None:
+                continue
+            old_pts, new_pts = old_points.get(movesan, 0), new_points.get(movesan, 0)
+            if old_pts != new_pts:
+                msg = '  {} bm {}: {} -> {}'.format(name, movesan, old_pts, new_pts)
+                logger.info(msg)
+                print(msg)
+
+    removed = [v for k, v in base_index.items() if k not in matched]
+    for base_line in removed:
+        msg = 'Removed position id {}: {}'.format(base_line[2], base_line[0])
+        logger.info(msg)
+        print(msg)
+
+    print('Changed positions: {}, removed positions: {}'.format(
+            len(changed), len(removed)))
+
+    return changed
+
+
+def rescore_epd_outputs(fen_list, epd_out_fns, engine_names, rating,
+                        base_fen_list=None, group_keys=None):
+    """ Score saved epd outputs against the solutions in fen_list without
+        running the engines again, returns the results in the format
+        [engine, top1cnt, score, maxscore, numpostried, elapsed, rating]
+        and the results by group if group_keys is given
+    """
+    table = SolutionTable(fen_list)
+    keys = [epd_key(fen_line[0]) for fen_line in fen_list]
+
+    engine_moves = []
+    for fn in epd_out_fns:
+        bm_index = read_epd_output(fn)
+        moves = [bm_index.get(k) for k in keys]
+        logger.info('{}: {} / {} positions found'.format(
+                fn, len(moves) - moves.count(None), len(moves)))
+        engine_moves.append(moves)
+
+    if base_fen_list is not None:
+        report_changed_positions(fen_list, base_fen_list, engine_names, engine_moves)
+
+    choices = np.stack([table.choice_indices(moves) for moves in engine_moves])
+    top1, score, max_score, tried = table.rescore(choices)
+
+    ana_data = []
+    for i, name in enumerate(engine_names):
+        ana_data.append([name, int(top1[i]), int(score[i]), int(max_score[i]),
+                         int(tried[i]), 0.0, rating])
+
+    group_data = []
+    if group_keys is not None:
+        groups, masks = table.group_masks(group_keys)
+        counts = table.rescore(choices, masks)
+        for i, name in enumerate(engine_names):
+            rows = [[g] + [int(c[i, j]) for c in counts] for j, g in enumerate(groups)]
+            group_data.append((name, rows))
+
+    return ana_data, group_data
+
+
+class SolutionTable():
+    """ Solution points of an epd list and engine choices as arrays
+
+    An engine choice is the column of the engine move in the points table,
+    the last column has 0 points and is used for moves that are not in the
+    solutions, -1 is used for positions not tried by the engine. Scores of
+    many engines, position subsets and bootstrap samples are computed with
+    array operations instead of one position at a time.
+    """
+    def __init__(self, fen_list):
+        if np is None:
+            raise ImportError('numpy is required for rescoring, pip install numpy')
+
+        self.num_pos = len(fen_list)
+        self.ids = [fen_line[2] for fen_line in fen_list]
+        self.move_cols = []  # {move: column} per position
+        self.miss_col = max((len(fen_line[4]) for fen_line in fen_list), default=0)
+        self.points = np.zeros((self.num_pos, self.miss_col + 1), dtype=np.int32)
+
+        for i, fen_line in enumerate(fen_list):
+            cols = {}
+            for j, (m, move_score) in enumerate(fen_line[4]):
+                cols.setdefault(m, j)
+                self.points[i, j] = move_score
+            self.move_cols.append(cols)
+
+        # The first solution move has the highest score
+        self.max_points = self.points[:, 0].copy()
+
+    def with_points(self, scheme):
+        """ Returns a copy of the table with points replaced by scheme(points)
+
+        scheme gets and returns an array of shape (num_pos, num_solutions),
+        example top move only: lambda p: p * (p == p[:, :1])
+        """
+        table = copy.copy(self)
+        new_points = np.asarray(scheme(self.points[:, :self.miss_col]))
+        table.points = np.zeros(self.points.shape, dtype=new_points.dtype)
+        table.points[:, :self.miss_col] = new_points
+        table.max_points = table.points[:, 0].copy()
+
+        return table
+
+    def choice_indices(self, moves):
+        """ Convert engine moves in san per position to choice columns,
+            a move of None means the position was not tried
+        """
+        return np.array([-1 if m is None else cols.get(m, self.miss_col)
+                         for cols, m in zip(self.move_cols, moves)],
+                        dtype=np.int16)
+
+    def engine_points(self, choices, idx=None):
+        """ Returns points and max points per engine and position,
+            choices has a shape of (num_engines, num_pos) or of
+            (num_engines, len(idx)) for the positions in idx
+        """
+        choices = np.atleast_2d(choices)
+        rows = np.arange(self.num_pos) if idx is None else idx
+        tried = choices >= 0
+        cols = np.where(tried, choices, self.miss_col)
+        points = self.points[rows, cols]
+        max_points = tried * self.max_points[rows]
+
+        return points, max_points
+
+    def subset_mask(self, prefix):
+        """ Returns a bool mask of positions with id starting with prefix """
+        return np.array([epd_id is not None and epd_id.startswith(prefix)
+                         for epd_id in self.ids], dtype=bool)
+
+    def group_masks(self, keys):
+        """ Returns group names and a bool mask per group of shape
+            (num_groups, num_pos) from a group key per position
+        """
+        names = sorted({k for k in keys if k is not None})
+        col = {name: i for i, name in enumerate(names)}
+        masks = np.zeros((len(names), self.num_pos), dtype=bool)
+        for i, k in enumerate(keys):
+            if k is not None:
+                masks[col[k], i] = True
+
+        return names, masks
+
+    def rescore(self, choices, masks=None):
+        """ Returns top1, score, max score and tried counts per engine, if
+            masks of shape (num_groups, num_pos) is given the counts have a
+            shape of (num_engines, num_groups)
+        """
+        choices = np.atleast_2d(choices)
+        points, max_points = self.engine_points(choices)
+        tried = choices >= 0
+        top1 = choices == 0
+
+        if masks is None:
+            return (top1.sum(axis=1), points.sum(axis=1),
+                    max_points.sum(axis=1), tried.sum(axis=1))
+
+        m = np.atleast_2d(masks).T.astype(np.int64)
+        return (top1.astype(np.int64) @ m, points.astype(np.int64) @ m,
+                max_points.astype(np.int64) @ m, tried.astype(np.int64) @ m)
+
+    def bootstrap(self, choices, samples=1000, mask=None, seed=None):
+        """ Returns score rates per engine of shape (num_engines, samples)
+            from positions resampled with replacement
+        """
+        choices = np.atleast_2d(choices)
+        idx = np.arange(self.num_pos) if mask is None else np.flatnonzero(mask)
+        n = len(idx)
+        if n == 0:
+            return np.zeros((len(choices), samples), dtype=np.float32)
+
+        # Resampling is done as the number of times each position is drawn
+        rng = np.random.default_rng(seed)
+        weights = rng.multinomial(n, np.full(n, 1.0/n), size=samples).T.astype(np.float32)
+
+        points, max_points = self.engine_points(choices[:, idx], idx)
+        scores = points.astype(np.float32) @ weights
+        max_scores = max_points.astype(np.float32) @ weights
+
+        return np.divide(scores, max_scores, out=np.zeros_like(scores),
+                         where=max_scores > 0)
+
+
+def get_rates(top1_cnt, epd_cnt_tried, total_score, max_score):
+    """ Returns top1 rate and score rate """
+    top1_rate = 0.0
+    if epd_cnt_tried:
+        top1_rate = float(top1_cnt)/epd_cnt_tried
+    
+    score_rate = 0.0
+    if max_score:
+        score_rate = float(total_score)/max_score
+
+    return top1_rate, score_rate
 
 
 def write_results_summary(out_fn, data, threadsval, hashval, movetime,
-                          input_epd_path_and_file, input_epd_file, good_epd_cnt):
-    """ Write results summary in text format """
+                          input_epd_path_and_file, input_epd_file, good_epd_cnt,
+                          placement=None, num_duplicates=None):
+    """ Write results summary in text format, settings of 0 are not known """
     if not os.path.isfile(out_fn):
         with open(out_fn, 'a') as f:
             f.write('A. Engine settings\n')
             
-            f.write('Threads        : %d\n' % threadsval)
-            f.write('Hash (mb)      : %d\n' % hashval)
-            f.write('Time(s)/pos    : %0.1f\n\n' % (float(movetime)/1000))
+            f.write('Threads        : %s\n' % (threadsval or 'unknown'))
+            f.write('Hash (mb)      : %s\n' % (hashval or 'unknown'))
+            if placement is not None:
+                f.write('Placement      : %s\n' % placement)
+            f.write('Time(s)/pos    : %s\n\n' % (
+                    '%0.1f' % (float(movetime)/1000) if movetime else 'unknown'))
 
 
             f.write('B. Test set\n')
            
             f.write('Filename       : %s\n' % input_epd_file)
-            f.write('NumPos         : %s\n\n' % good_epd_cnt)
+            f.write('NumPos         : %s\n' % good_epd_cnt)
+            if num_duplicates is not None:
+                f.write('Duplicates     : %s\n' % num_duplicates)
+            f.write('\n')
 
 
             f.write('C. Results\n')
@@ -773,20 +1785,10 @@ def write_results_summary(out_fn, data, threadsval, hashval, movetime,
     logger.info('Writing analysis results ...')
     with open(out_fn, 'a') as f:
         for n in data:
-            engine_name = n[0]
-            top1_cnt = n[1]
-            total_score = n[2]
-            max_score = n[3]
-            epd_cnt_tried = n[4]
-            rating = n[6]
-
-            top1_rate = 0.0
-            if epd_cnt_tried:
-                top1_rate = float(top1_cnt)/epd_cnt_tried
-            
-            score_rate = 0.0
-            if max_score:
-                score_rate = float(total_score)/max_score
+            # [engine, top1cnt, score, maxscore, numpostried, elapsed, rating]
+            engine_name, top1_cnt, total_score, max_score, epd_cnt_tried, _, rating = n
+            top1_rate, score_rate = get_rates(top1_cnt, epd_cnt_tried,
+                                              total_score, max_score)
             f.write('%-32s : %6d  %5d  %7d  %8.3f  %5d  %8d  %9.3f\n' % (
                     engine_name, rating, top1_cnt, epd_cnt_tried,
                     top1_rate, total_score, max_score, score_rate))
@@ -804,20 +1806,10 @@ def write_results_in_csv(csv_fn, ana_data,
             
     with open(csv_fn, 'a') as f:
         for n in ana_data:
-            engine_name = n[0]
-            top1_cnt = n[1]
-            total_score = n[2]
-            max_score = n[3]
-            epd_cnt_tried = n[4]
-            rating = n[6]
-
-            top1_rate = 0.0
-            if epd_cnt_tried:
-                top1_rate = float(top1_cnt)/epd_cnt_tried
-            
-            score_rate = 0.0
-            if max_score:
-                score_rate = float(total_score)/max_score
+            # [engine, top1cnt, score, maxscore, numpostried, elapsed, rating]
+            engine_name, top1_cnt, total_score, max_score, epd_cnt_tried, _, rating = n
+            top1_rate, score_rate = get_rates(top1_cnt, epd_cnt_tried,
+                                              total_score, max_score)
             f.write('%s,%d,%d,%d,%0.3f,%d,%d,%0.3f,%d,%d,%d\n' % (engine_name,
                     rating, top1_cnt, epd_cnt_tried, top1_rate, total_score,
                     max_score, score_rate, ana_time, engine_numhash,
@@ -881,16 +1873,1192 @@ def write_results_in_csv(csv_fn, ana_data,
                     cnt, engine_name, rating, top1, maxtop1, top1rate,
                     score, maxscore, scorerate, movetime, hashval, threadsval))
             
+def format_cpus(cpus):
+    """ Format cpu numbers as ranges, [0, 1, 2, 3, 6] -> '0-3,6' """
+    ranges = []
+    for _, g in itertools.groupby(enumerate(sorted(cpus)), lambda x: x[1] - x[0]):
+        g = [c for _, c in g]
+        ranges.append(str(g[0]) if len(g) == 1 else '%d-%d' % (g[0], g[-1]))
+
+    return ','.join(ranges)
+
+
+def parse_cpu_list(value):
+    """ Convert cpu list '0-3,8' to [0, 1, 2, 3, 8] """
+    cpus = set()
+    for v in value.split(','):
+        v = v.strip()
+        if not v:
+            continue
+        try:
+            if '-' in v:
+                first, last = v.split('-')
+                cpus.update(range(int(first), int(last) + 1))
+            else:
+                cpus.add(int(v))
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                    'cpu list should be like 0-3,8, not {}'.format(value))
+
+    return sorted(cpus)
+
+
+def get_numa_nodes():
+    """ Returns {node: [cpus]} of the available cpus from Linux sysfs, all
+        cpus are in node 0 if there is no numa info
+    """
+    available = set(get_available_cpus())
+    numa_nodes = {}
+    for node_path in sorted(Path('/sys/devices/system/node').glob('node[0-9]*')):
+        try:
+            cpus = parse_cpu_list(Path(node_path, 'cpulist').read_text())
+        except (OSError, ValueError):
+            continue
+        cpus = [c for c in cpus if c in available]
+        if cpus:
+            numa_nodes[int(node_path.name[4:])] = cpus
+
+    return numa_nodes or {0: sorted(available)}
+
+
+def get_numa_node(cpus, numa_nodes):
+    """ Returns the node where all cpus are or None """
+    for node, node_cpus in numa_nodes.items():
+        if set(cpus) <= set(node_cpus):
+            return node
+
+    return None
+
+
+def allocate_cpus(free_cpus, ncpus, numa_nodes):
+    """ Returns ncpus from free_cpus, from one numa node if possible, the
+        node with the least free cpus that can fit is used
+    """
+    best = None
+    for node_cpus in numa_nodes.values():
+        node_free = [c for c in free_cpus if c in node_cpus]
+        if len(node_free) >= ncpus and (best is None or len(node_free) < len(best)):
+            best = node_free
+
+    return (best or free_cpus)[:ncpus]
+
+
+def get_available_cpus():
+    """ Returns a sorted list of cpu numbers this process can run on """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+
+    return list(range(os.cpu_count() or 1))
+
+
+def get_memory_mb():
+    """ Returns physical memory in mb or None if it is not known """
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // (1024*1024)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def get_sweep_configs(threads_list, hash_list, movetime_list):
+    """ Returns a list of {'threads', 'hash', 'movetime'} of the grid """
+    return [{'threads': t, 'hash': h, 'movetime': mt} for mt, h, t in
+            itertools.product(movetime_list, hash_list, threads_list)]
+
+
+def run_sweep(create_config_analyze, configs, cpus, max_memory_mb,
+              engine_memory_mb=64, numa_nodes=None):
+    """ Run configs concurrently as long as their threads fit in cpus and
+        their hash fit in max_memory_mb, each engine is pinned to its own
+        cpus on one numa node if possible
+
+    create_config_analyze: function that returns an Analyze given config,
+                           cpus and numa node
+    Returns a list of (config, cpus, numa node, result, elapsed)
+    """
+    numa_nodes = numa_nodes or {0: list(cpus)}
+    pending = sorted(configs, key=lambda c: (c['threads'], c['hash']), reverse=True)
+    free_cpus = list(cpus)
+    used_memory = 0
+    running = {}
+    sweep_data = []
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(cpus)) as executor:
+        while pending or running:
+            # Start the configs that can fit, the largest first
+            for config in list(pending):
+                memory = config['hash'] + engine_memory_mb
+                fit_memory = (max_memory_mb is None or
+                              used_memory + memory <= max_memory_mb)
+                ncpus = min(config['threads'], len(cpus))
+                if ncpus > len(free_cpus) or not fit_memory:
+                    # A config that can never fit is run alone
+                    if running:
+                        continue
+                    logger.warning('Config %s is larger than the machine, '
+                                   'run it alone' % config)
+                    ncpus = len(free_cpus)
+
+                config_cpus = allocate_cpus(free_cpus, ncpus, numa_nodes)
+                free_cpus = [c for c in free_cpus if c not in config_cpus]
+                used_memory += memory
+                pending.remove(config)
+                node = get_numa_node(config_cpus, numa_nodes)
+
+                a = create_config_analyze(config, config_cpus, node)
+                logger.info('Start config %s on %s' % (config, a.get_placement()))
+                future = executor.submit(run_analyze_timed, a)
+                running[future] = (config, config_cpus, a, memory)
+
+            done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                config, config_cpus, a, memory = running.pop(future)
+                elapsed = future.result()
+                free_cpus = sorted(free_cpus + config_cpus)
+                used_memory -= memory
+                sweep_data.append((config, config_cpus, a.numa_node,
+                                   a.get_result(), elapsed))
+
+    return sweep_data
+
+
+def run_analyze_timed(a):
+    """ Run analysis and return the elapsed time in seconds """
+    start_time = time.perf_counter()
+    a.run()
+
+    return time.perf_counter() - start_time
+
+
+def write_sweep_results(output_summary_fn, sweep_data, engine_rating,
+                        input_epd_fn, good_epd_cnt, group_data=None):
+    """ Write sweep results in csv, a scaling table in text and csv
+        and the html from both
+
+    group_data: {(threads, hash, movetime): [[group, top1cnt, score,
+                maxscore, numpostried], ...]} or None
+    """
+    csv_fn = output_summary_fn[0:-4] + '.csv'
+    html_fn = output_summary_fn[0:-4] + '.html'
+    sweep_csv_fn = output_summary_fn[0:-4] + '_sweep.csv'
+    group_csv_fn = None
+    fd, temp_csv_fn = tempfile.mkstemp(suffix='.csv')
+    os.close(fd)
+
+    sweep_data = sorted(sweep_data, key=lambda d: (
+            d[0]['movetime'], d[0]['hash'], d[0]['threads']))
+
+    # Score rate of the config with the least threads of the same hash and
+    # movetime is the base of the scaling curve over threads
+    rows, base_rates = [], {}
+    for config, cpus, node, result, elapsed in sweep_data:
+        name, top1_cnt, total_score, max_score, epd_cnt_tried = result
+        top1_rate, score_rate = get_rates(top1_cnt, epd_cnt_tried,
+                                          total_score, max_score)
+        base_rate = base_rates.setdefault((config['movetime'], config['hash']),
+                                          score_rate)
+        rows.append([config['threads'], config['hash'], config['movetime'],
+                     top1_rate, score_rate, score_rate - base_rate, elapsed,
+                     format_cpus(cpus), '' if node is None else str(node)])
+        write_results_in_csv(csv_fn, [result + [elapsed, engine_rating]],
+                             config['movetime'], config['hash'],
+                             config['threads'], temp_csv_fn)
+        if group_data:
+            group_csv_fn = output_summary_fn[0:-4] + '_groups.csv'
+            write_group_results_in_csv(group_csv_fn, name, group_data[(
+                    config['threads'], config['hash'], config['movetime'])],
+                    config['movetime'], config['hash'], config['threads'])
+
+    delete_file(sweep_csv_fn)
+    with open(sweep_csv_fn, 'w') as f:
+        f.write('Threads,Hash(MB),MoveTime(ms),Top1Rate,ScoreRate,'
+                'ScoreRateGain,Elapsed(s),Cpus,NumaNode\n')
+        for row in rows:
+            f.write('%d,%d,%d,%0.3f,%0.3f,%0.3f,%0.1f,"%s",%s\n' % tuple(row))
+
+    with open(output_summary_fn, 'a') as f:
+        f.write('Sweep\n')
+        f.write('Filename       : %s\n' % os.path.basename(input_epd_fn))
+        f.write('NumPos         : %s\n\n' % good_epd_cnt)
+        f.write('%7s  %8s  %11s  %8s  %9s  %13s  %10s  %-8s  %s\n' % (
+                'Threads', 'Hash(MB)', 'MoveTime(ms)', 'Top1Rate',
+                'ScoreRate', 'ScoreRateGain', 'Elapsed(s)', 'Cpus', 'NumaNode'))
+        for row in rows:
+            f.write('%7d  %8d  %11d  %8.3f  %9.3f  %+13.3f  %10.1f  %-8s  %s\n' % tuple(row))
+        f.write('\n')
+
+    delete_file(html_fn)
+    csv_to_html(temp_csv_fn, html_fn, input_epd_fn, group_csv_fn, sweep_csv_fn)
+    delete_file(temp_csv_fn)
+
+
+# Columns of per position results in export files, type is an array
+# typecode or 's' for string
+RESULT_COLUMNS = [('key', 'Q'), ('epd', 's'), ('id', 's'), ('pos', 'q'),
+                  ('engine', 's'), ('threads', 'q'), ('hash', 'q'),
+                  ('movetime', 'q'), ('placement', 's'), ('bm', 's'),
+                  ('ce', 'q'), ('acd', 'q'), ('points', 'q'),
+                  ('max_points', 'q'), ('is_top1', 'q'), ('multipv', 's'),
+                  ('elapsed_ms', 'd'), ('nps', 'q')]
+COLUMNAR_MAGIC = b'MEACOL1\n'
+
+
+def get_result_columns(a):
+    """ Returns {column: values} of the position results of Analyze a """
+    config = {'engine': a.name, 'threads': a.num_threads, 'hash': a.num_hash,
+              'movetime': a.movetime, 'placement': a.get_placement()}
+    columns = {}
+    for name, _ in RESULT_COLUMNS:
+        if name in config:
+            columns[name] = [config[name]] * len(a.pos_results)
+        elif name == 'multipv':
+            columns[name] = [json.dumps(r[name]) for r in a.pos_results]
+        else:
+            columns[name] = [r[name] for r in a.pos_results]
+
+    return columns
+
+
+def write_columnar(fn, columns):
+    """ Write {column: values} to a packed columnar file
+
+    File layout: magic, column blocks, json footer, footer length (uint64),
+    magic. The footer is the index with the offset and length of each
+    column block so a reader only reads the columns it needs. A string
+    column block is num_rows+1 uint64 offsets followed by utf-8 data.
+    """
+    types = dict(RESULT_COLUMNS)
+    num_rows = len(next(iter(columns.values()), []))
+    footer = {'num_rows': num_rows, 'byteorder': sys.byteorder, 'columns': []}
+
+    with open(fn, 'wb') as f:
+        f.write(COLUMNAR_MAGIC)
+        for name, values in columns.items():
+            typecode = types.get(name, 's')
+            if typecode == 's':
+                data = [('' if v is None else str(v)).encode('utf-8') for v in values]
+                offsets = array('Q', [0])
+                for d in data:
+                    offsets.append(offsets[-1] + len(d))
+                block = offsets.tobytes() + b''.join(data)
+            else:
+                block = array(typecode, [0 if v is None else v for v in values]).tobytes()
+
+            footer['columns'].append({'name': name, 'type': typecode,
+                                      'offset': f.tell(), 'length': len(block)})
+            f.write(block)
+
+        footer_data = json.dumps(footer).encode('utf-8')
+        f.write(footer_data)
+        f.write(struct.pack('<Q', len(footer_data)))
+        f.write(COLUMNAR_MAGIC)
+
+
+def read_columnar(fn, columns=None):
+    """ Read columns from a packed columnar file, all if columns is None,
+        returns {column: values}
+    """
+    with open(fn, 'rb') as f:
+        f.seek(-8 - len(COLUMNAR_MAGIC), os.SEEK_END)
+        footer_len = struct.unpack('<Q', f.read(8))[0]
+        if f.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            raise ValueError('{} is not a mea columnar file'.format(fn))
+        f.seek(-8 - len(COLUMNAR_MAGIC) - footer_len, os.SEEK_END)
+        footer = json.loads(f.read(footer_len).decode('utf-8'))
+
+        num_rows = footer['num_rows']
+        swap = footer['byteorder'] != sys.byteorder
+        data = {}
+        for col in footer['columns']:
+            if columns is not None and col['name'] not in columns:
+                continue
+            f.seek(col['offset'])
+            block = f.read(col['length'])
+            if col['type'] == 's':
+                offsets = array('Q')
+                offsets.frombytes(block[:8 * (num_rows + 1)])
+                if swap:
+                    offsets.byteswap()
+                text = block[8 * (num_rows + 1):]
+                data[col['name']] = [text[offsets[i]:offsets[i+1]].decode('utf-8')
+                                     for i in range(num_rows)]
+            else:
+                values = array(col['type'])
+                values.frombytes(block)
+                if swap:
+                    values.byteswap()
+                data[col['name']] = values
+
+    return data
+
+
+def export_results(fn, columns):
+    """ Write position results to parquet if fn ends with .parquet and
+        pyarrow is installed, otherwise to a packed columnar file
+    """
+    if fn.endswith('.parquet'):
+        if pyarrow is None:
+            raise ImportError('pyarrow is required for parquet, pip install pyarrow')
+        arrow_types = {'Q': pyarrow.uint64(), 'q': pyarrow.int64(),
+                       'd': pyarrow.float64(), 's': pyarrow.string()}
+        types = dict(RESULT_COLUMNS)
+        table = pyarrow.table({name: pyarrow.array(
+                values, type=arrow_types[types.get(name, 's')])
+                for name, values in columns.items()})
+        pyarrow.parquet.write_table(table, fn)
+    else:
+        write_columnar(fn, columns)
+    logger.info('Position results are exported to {}'.format(fn))
+
+
+def import_results(fns, columns=None):
+    """ Read and concatenate position results from export files, only the
+        given columns are read, returns {column: list of values}
+    """
+    data = {}
+    for fn in fns:
+        if fn.endswith('.parquet'):
+            if pyarrow is None:
+                raise ImportError('pyarrow is required for parquet, pip install pyarrow')
+            file_data = pyarrow.parquet.read_table(fn, columns=columns).to_pydict()
+        else:
+            file_data = read_columnar(fn, columns)
+        extend_columns(data, file_data)
+
+    return data
+
+
+def extend_columns(data, new_data):
+    """ Append the rows of new_data to data, both {column: values}, a
+        column that is only in one of them is None in the other rows
+    """
+    num_rows = len(next(iter(data.values()), []))
+    num_new_rows = len(next(iter(new_data.values()), []))
+    for name in data.keys() | new_data.keys():
+        values = list(data.get(name, [None] * num_rows))
+        values.extend(new_data.get(name, [None] * num_new_rows))
+        data[name] = values
+
+
+REPORT_CHUNK_SIZE = 100  # positions per data file of the html report
+
+
+def get_report_data(columns, fen_list=None, chunk_size=REPORT_CHUNK_SIZE):
+    """ Returns (summary, chunks) of the html report from position result
+        columns, a chunk is a list of positions with the result of each
+        engine, [epd, id, maxpoints, solutions, [[bm, points, ce, acd, ms, top1], ...]]
+    """
+    solutions = {}
+    for fen_line in fen_list or []:
+        solutions.setdefault(epd_key(fen_line[0]), ', '.join(
+                '%s=%d' % (m, pts) for m, pts in fen_line[4]))
+
+    # An engine is a name and settings, settings are added to the label
+    # when the same name is run with different settings. The same epd and
+    # id in the results of an engine is the next position.
+    configs = {}  # {(engine, threads, hash, movetime): engine index}
+    positions = {}  # {(epd, id, occurrence): position index}
+    occurrences = {}  # {(engine index, epd, id): count}
+    rows = []  # [epd, id, maxpoints, {engine index: result}]
+
+    # Export files of earlier versions have no is_top1, the best points
+    # is top1 then
+    top1s = columns.get('is_top1', [None] * len(columns['engine']))
+    for name, threads, hash_mb, movetime, epd, epd_id, max_points, bm, \
+            points, ce, acd, ms, is_top1 in zip(*[columns[c] for c in (
+            'engine', 'threads', 'hash', 'movetime', 'epd', 'id',
+            'max_points', 'bm', 'points', 'ce', 'acd', 'elapsed_ms')], top1s):
+        epd_id = epd_id or ''
+        if is_top1 is None:
+            is_top1 = points == max_points and max_points > 0
+        engine = configs.setdefault((name, threads, hash_mb, movetime), len(configs))
+        k = occurrences.get((engine, epd, epd_id), 0)
+        occurrences[(engine, epd, epd_id)] = k + 1
+        index = positions.setdefault((epd, epd_id, k), len(rows))
+        if index == len(rows):
+            rows.append([epd, epd_id, max_points, {}])
+        rows[index][3][engine] = [bm, points, ce, acd, round(ms), int(is_top1)]
+
+    names = [c[0] for c in configs]
+    labels = [c[0] if names.count(c[0]) == 1 else
+              '%s th%d hash%d mt%d' % c for c in configs]
+
+    # [label, positions, top1, score, maxscore, total ms, total depth]
+    engines = [[label, 0, 0, 0, 0, 0, 0] for label in labels]
+    rates, num_moves = [], []
+    for epd, epd_id, max_points, results in rows:
+        total, moves = 0, set()
+        for engine, (bm, points, ce, acd, ms, is_top1) in results.items():
+            stats = engines[engine]
+            stats[1] += 1
+            stats[2] += is_top1
+            stats[3] += points
+            stats[4] += max_points
+            stats[5] += ms
+            stats[6] += acd
+            total += points
+            moves.add(bm)
+        max_total = max_points * len(results)
+        rates.append(round(total / max_total, 3) if max_total else None)
+        num_moves.append(len(moves))
+
+    summary = {'title': APP_NAME_VERSION, 'engines': engines,
+               'ids': [r[1] for r in rows], 'rates': rates,
+               'moves': num_moves, 'chunk_size': chunk_size}
+    chunks = []
+    for start in range(0, len(rows), chunk_size):
+        chunks.append([[epd, epd_id, max_points, solutions.get(epd, ''),
+                        [results.get(e) for e in range(len(labels))]]
+                       for epd, epd_id, max_points, results in
+                       rows[start:start+chunk_size]])
+
+    return summary, chunks
+
+
+def write_html_report(report_dir, columns, epd_fn, fen_list=None):
+    """ Write index.html and its data files to report_dir, the summary is
+        loaded with the page and position results are loaded in chunks
+        when they are viewed
+    """
+    summary, chunks = get_report_data(columns, fen_list)
+    summary['epd'] = os.path.basename(epd_fn)
+
+    data_dir = Path(report_dir, 'data')
+    data_dir.mkdir(parents=True, exist_ok=True)
+    for fn in data_dir.glob('pos_*.js'):
+        fn.unlink()
+
+    # Data files are scripts so that the page can load them from disk
+    with open(Path(data_dir, 'summary.js'), 'w') as f:
+        f.write('MEA.setSummary(%s);\n' % json.dumps(summary, separators=(',', ':')))
+    for k, chunk in enumerate(chunks):
+        with open(Path(data_dir, 'pos_%03d.js' % k), 'w') as f:
+            f.write('MEA.addChunk(%d,%s);\n' % (k, json.dumps(chunk, separators=(',', ':'))))
+    with open(Path(report_dir, 'index.html'), 'w') as f:
+        f.write(REPORT_HTML)
+
+    logger.info('Html report is saved in {}'.format(report_dir))
+    print('Html report is saved in {}'.format(Path(report_dir, 'index.html')))
+
+
+def write_report(report_dir, columns, report_from, epd_fn, fen_list=None):
+    """ Write html report of columns and of the export files in report_from """
+    data = import_results(report_from) if report_from else {}
+    extend_columns(data, columns or {})
+    if not data.get('engine'):
+        logger.warning('No position results for the html report')
+        return
+    write_html_report(report_dir, data, epd_fn, fen_list)
+
+
+REPORT_HTML = r'''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>MEA report</title>
+<style>
+body{margin:0 64px 32px 64px;font-family:"Calibri",sans-serif;font-size:15px;}
+table{border-collapse:collapse;width:100%;}
+th,td{border:1px solid #999;padding:3px 6px;text-align:left;}
+th{background:black;color:white;cursor:pointer;}
+tr:nth-child(even){background:#eee;}
+#positions tr{cursor:pointer;}
+.bar{display:inline-block;height:10px;background:#4a7;}
+.charts{display:flex;gap:48px;}
+</style>
+</head>
+<body>
+<h3 id="title"></h3>
+<div id="info"></div>
+<h4>A. Engines</h4>
+<table id="engines"></table>
+<div class="charts">
+<div><h4>B. Score rate</h4><svg id="ratechart"></svg></div>
+<div><h4>C. Positions by score rate of all engines</h4><svg id="histchart"></svg></div>
+</div>
+<h4>D. Positions</h4>
+<div>
+Sort <select id="sort"><option value="pos">position</option>
+<option value="rate">hardest first</option><option value="moves">most moves</option></select>
+Id <input id="filter" size="24">
+<button id="prev">&lt;</button> <span id="page"></span> <button id="next">&gt;</button>
+</div>
+<table id="positions"></table>
+<h4>E. Position</h4>
+<div id="detail">Click a position.</div>
+<script>
+var MEA = {chunks: {}, waiting: {}};
+MEA.setSummary = function (s) { MEA.s = s; };
+MEA.addChunk = function (k, data) {
+  MEA.chunks[k] = data;
+  (MEA.waiting[k] || []).forEach(function (f) { f(data); });
+  delete MEA.waiting[k];
+};
+</script>
+<script src="data/summary.js"></script>
+<script>
+var PAGE = 100, s = MEA.s, order = [], page = 0;
+
+function loadChunk(k, done) {
+  if (MEA.chunks[k]) { done(MEA.chunks[k]); return; }
+  if (MEA.waiting[k]) { MEA.waiting[k].push(done); return; }
+  MEA.waiting[k] = [done];
+  var e = document.createElement('script');
+  e.src = 'data/pos_' + String(k).padStart(3, '0') + '.js';
+  document.head.appendChild(e);
+}
+
+function cell(tr, tag, value) {
+  var c = document.createElement(tag);
+  if (value instanceof Node) c.appendChild(value); else c.textContent = value;
+  tr.appendChild(c);
+  return c;
+}
+
+function bar(rate) {
+  var b = document.createElement('span');
+  b.className = 'bar';
+  b.style.width = Math.round(80 * rate) + 'px';
+  return b;
+}
+
+function fillTable(table, header, rows, onclick, onsort) {
+  var body = document.createDocumentFragment(), tr = document.createElement('tr');
+  header.forEach(function (h, i) {
+    cell(tr, 'th', h).onclick = onsort ? function () { onsort(i); } : null;
+  });
+  body.appendChild(tr);
+  rows.forEach(function (row, r) {
+    tr = document.createElement('tr');
+    row.forEach(function (v) { cell(tr, 'td', v); });
+    if (onclick) tr.onclick = function () { onclick(r); };
+    body.appendChild(tr);
+  });
+  table.textContent = '';
+  table.appendChild(body);
+}
+
+function engineRows() {
+  return s.engines.map(function (e) {
+    return [e[0], e[1], e[2], (e[1] ? e[2] / e[1] : 0).toFixed(3), e[3], e[4],
+            (e[4] ? e[3] / e[4] : 0).toFixed(3), e[1] ? Math.round(e[5] / e[1]) : 0,
+            e[1] ? (e[6] / e[1]).toFixed(1) : 0];
+  });
+}
+
+function showEngines(col, desc) {
+  var rows = engineRows();
+  rows.sort(function (a, b) {
+    var x = a[col], y = b[col];
+    if (!isNaN(x) && !isNaN(y)) { x = +x; y = +y; }
+    return (x < y ? -1 : x > y ? 1 : 0) * (desc ? -1 : 1);
+  });
+  fillTable(document.getElementById('engines'), ['Engine', 'Positions', 'Top1',
+            'Top1Rate', 'Score', 'MaxScore', 'ScoreRate', 'Time(ms)/pos',
+            'Depth/pos'], rows, null, function (c) { showEngines(c, c === col ? !desc : true); });
+}
+
+function svg(id, width, height) {
+  var e = document.getElementById(id);
+  e.setAttribute('width', width);
+  e.setAttribute('height', height);
+  e.textContent = '';
+  return e;
+}
+
+function svgAdd(parent, tag, attrs, text) {
+  var e = document.createElementNS('http://www.w3.org/2000/svg', tag);
+  for (var a in attrs) e.setAttribute(a, attrs[a]);
+  if (text !== undefined) e.textContent = text;
+  parent.appendChild(e);
+}
+
+function showRateChart() {
+  var rows = engineRows().sort(function (a, b) { return b[6] - a[6]; });
+  var h = 16, labelw = 240, w = 300, chart = svg('ratechart', labelw + w + 60, h * rows.length);
+  rows.forEach(function (r, i) {
+    svgAdd(chart, 'text', {x: 0, y: i * h + 12, 'font-size': 12}, r[0]);
+    svgAdd(chart, 'rect', {x: labelw, y: i * h + 2, width: w * r[6], height: h - 4, fill: '#4a7'});
+    svgAdd(chart, 'text', {x: labelw + w * r[6] + 4, y: i * h + 12, 'font-size': 12}, r[6]);
+  });
+}
+
+function showHistogram() {
+  var bins = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0], top = 1;
+  s.rates.forEach(function (r) { if (r !== null) bins[Math.min(9, Math.floor(r * 10))]++; });
+  bins.forEach(function (n) { top = Math.max(top, n); });
+  var w = 36, h = 160, chart = svg('histchart', w * 10, h + 40);
+  bins.forEach(function (n, i) {
+    var bh = Math.round(h * n / top);
+    svgAdd(chart, 'rect', {x: i * w + 2, y: h - bh + 14, width: w - 4, height: bh, fill: '#47a'});
+    svgAdd(chart, 'text', {x: i * w + 4, y: h - bh + 10, 'font-size': 11}, n);
+    svgAdd(chart, 'text', {x: i * w + 4, y: h + 30, 'font-size': 11}, (i / 10).toFixed(1));
+  });
+}
+
+function sortPositions() {
+  var key = document.getElementById('sort').value;
+  var text = document.getElementById('filter').value.toLowerCase();
+  order = [];
+  for (var i = 0; i < s.ids.length; i++)
+    if (!text || (s.ids[i] || '').toLowerCase().indexOf(text) >= 0) order.push(i);
+  if (key === 'rate') order.sort(function (a, b) { return (s.rates[a] || 0) - (s.rates[b] || 0); });
+  if (key === 'moves') order.sort(function (a, b) { return s.moves[b] - s.moves[a]; });
+  page = 0;
+  showPositions();
+}
+
+function showPositions() {
+  var pages = Math.max(1, Math.ceil(order.length / PAGE));
+  page = Math.max(0, Math.min(page, pages - 1));
+  var shown = order.slice(page * PAGE, (page + 1) * PAGE);
+  document.getElementById('page').textContent = 'page ' + (page + 1) + ' / ' + pages +
+      ', ' + order.length + ' positions';
+  fillTable(document.getElementById('positions'), ['Pos', 'Id', 'ScoreRate', '', 'Moves'],
+            shown.map(function (i) {
+              var r = s.rates[i];
+              return [i + 1, s.ids[i] || '', r === null ? '' : r.toFixed(3), bar(r || 0), s.moves[i]];
+            }), function (r) { showPosition(shown[r]); });
+}
+
+function showPosition(i) {
+  var detail = document.getElementById('detail');
+  detail.textContent = 'Loading ...';
+  loadChunk(Math.floor(i / s.chunk_size), function (chunk) {
+    var p = chunk[i % s.chunk_size], moves = {};
+    detail.textContent = '';
+    [['Pos', i + 1], ['Id', p[1] || ''], ['EPD', p[0]], ['Solutions', p[3]], ['MaxPoints', p[2]]]
+        .forEach(function (kv) {
+          var d = document.createElement('div');
+          d.textContent = kv[0] + ': ' + kv[1];
+          detail.appendChild(d);
+        });
+    var rows = [];
+    p[4].forEach(function (r, e) {
+      if (!r) return;
+      rows.push([s.engines[e][0], r[0], r[1], r[2], r[3], r[4]]);
+      moves[r[0]] = moves[r[0]] || [r[0], r[1], 0];
+      moves[r[0]][2]++;
+    });
+    rows.sort(function (a, b) { return b[2] - a[2] || a[0].localeCompare(b[0]); });
+    var mv = Object.keys(moves).map(function (m) { return moves[m]; })
+        .sort(function (a, b) { return b[2] - a[2]; })
+        .map(function (m) { return [m[0], m[1], m[2], bar(m[2] / rows.length)]; });
+    var t1 = document.createElement('table'), t2 = document.createElement('table');
+    fillTable(t1, ['Move', 'Points', 'Engines', ''], mv);
+    fillTable(t2, ['Engine', 'Move', 'Points', 'ce', 'acd', 'Time(ms)'], rows);
+    detail.appendChild(document.createElement('br'));
+    detail.appendChild(t1);
+    detail.appendChild(document.createElement('br'));
+    detail.appendChild(t2);
+  });
+}
+
+document.getElementById('title').textContent = s.title;
+document.getElementById('info').textContent = 'EPD: ' + s.epd + ', positions: ' +
+    s.ids.length + ', engines: ' + s.engines.length;
+document.getElementById('sort').onchange = sortPositions;
+document.getElementById('filter').oninput = sortPositions;
+document.getElementById('prev').onclick = function () { page--; showPositions(); };
+document.getElementById('next').onclick = function () { page++; showPositions(); };
+showEngines(6, true);
+showRateChart();
+showHistogram();
+sortPositions();
+</script>
+</body>
+</html>
+'''
+
+
+def get_solution_points(mpv, formula='linear', scale=GENERATE_SCALE,
+                        min_points=1):
+    """ Convert multipv [[bm, score, depth], ...] to [(move, points), ...]
+
+    The best move gets 100 points, other moves lose points by their score
+    gap in cp to the best move:
+    linear: 100 - gap/scale
+    exp   : 100 * exp(-gap/scale)
+    Moves with less than min_points are not included.
+    """
+    if not mpv:
+        return []
+
+    best_score = max(v[1] for v in mpv)
+    solution_points = []
+    for bm, score, _ in sorted(mpv, key=lambda v: v[1], reverse=True):
+        gap = best_score - score
+        if formula == 'exp':
+            points = round(100 * math.exp(-gap / scale))
+        else:
+            points = round(100 - gap / scale)
+        if points >= min_points and bm not in dict(solution_points):
+            solution_points.append((bm, points))
+
+    return solution_points
+
+
+def format_generated_epd(fen_line, solution_points, depth, ae_name):
+    """ Returns epd line with bm, c0, acd and Ae, other opcodes of the
+        input line like id are kept
+    """
+    epd = epd_key(fen_line[0])
+    rest = fen_line[3][len(epd):] if fen_line[3].startswith(epd) else ''
+    ops = ['%s %s;' % (op, operand.strip()) for op, operand in
+           re.findall(r'(\w+)\s+("[^"]*"|[^;]*);', rest)
+           if op not in ('bm', 'c0', 'acd', 'ce', 'Ae')]
+
+    best = solution_points[0][1]
+    bm = ' '.join(m for m, pts in solution_points if pts == best)
+    c0 = ', '.join('%s=%d' % (m, pts) for m, pts in solution_points)
+
+    return ' '.join([epd, 'bm %s;' % bm] + ops + [
+            'c0 "%s";' % c0, 'acd %d;' % depth, 'Ae "%s";' % ae_name])
+
+
+def run_generate(create_worker_analyze, fen_list, workers):
+    """ Analyze fen_list in multipv with workers engines in parallel,
+        returns the position results in the order of fen_list
+    """
+    if not fen_list:
+        return []
+
+    workers = max(1, min(workers, len(fen_list)))
+    chunk_size = -(-len(fen_list) // workers)
+    chunks = [fen_list[i:i+chunk_size] for i in range(0, len(fen_list), chunk_size)]
+
+    analyses = [create_worker_analyze(chunk, k)
+                for k, chunk in enumerate(chunks)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(analyses)) as executor:
+        list(executor.map(run_analyze_timed, analyses))
+
+    return [r for a in analyses for r in a.pos_results]
+
+
+def write_generated_epd(out_fn, fen_list, pos_results, ae_name,
+                        formula='linear', scale=GENERATE_SCALE,
+                        min_points=1):
+    """ Write the epd with c0 solution points from the multipv results """
+    num_written = 0
+    with open(out_fn, 'w') as f:
+        for fen_line, r in zip(fen_list, pos_results):
+            solution_points = get_solution_points(r['multipv'], formula,
+                                                  scale, min_points)
+            depth = min((v[2] for v in r['multipv']), default=r['acd'])
+
+            # Engine did not send multipv info, its bm is the only solution
+            if not solution_points and r['bm'] is not None:
+                solution_points = [(r['bm'], 100)]
+            if not solution_points:
+                logger.warning('No solution points for epd: {}'.format(fen_line[3]))
+                continue
+            f.write(format_generated_epd(fen_line, solution_points, depth,
+                                         ae_name) + '\n')
+            num_written += 1
+
+    logger.info('{} positions are saved in {}'.format(num_written, out_fn))
+    print('{} positions are saved in {}'.format(num_written, out_fn))
+
+
+class SequentialTest():
+    """ Confidence sequence of the score rate difference of two engines
+        on the same positions, it is updated after each position and can
+        be checked at any time without inflating the error rate
+
+    The difference is sum(points1 - points2)/sum(maxpoints), its interval
+    is from the normal mixture boundary with the mixture variance set to
+    min_positions positions. The variance has prior_positions pseudo
+    positions of variance (maxpoints/2)^2 so that engines that agree on
+    the first positions do not get a zero width interval.
+    """
+    def __init__(self, alpha=0.05, margin=0.02, min_positions=100,
+                 prior_positions=10):
+        self.alpha = alpha
+        self.margin = margin  # score rate difference that is negligible
+        self.min_positions = min_positions
+        self.prior_positions = prior_positions
+        self.n = 0
+        self.sum_d = 0.0  # points1 - points2
+        self.sum_m = 0.0  # maxpoints
+        self.sum_dd = 0.0
+        self.sum_dm = 0.0
+        self.sum_mm = 0.0
+
+    def update(self, points1, points2, max_points):
+        d = points1 - points2
+        self.n += 1
+        self.sum_d += d
+        self.sum_m += max_points
+        self.sum_dd += d * d
+        self.sum_dm += d * max_points
+        self.sum_mm += max_points * max_points
+
+    def get_diff(self):
+        """ Returns score rate of engine 1 minus score rate of engine 2 """
+        return self.sum_d / self.sum_m if self.sum_m else 0.0
+
+    def get_residual_ss(self):
+        """ Returns the sum of squares of the residuals d - diff*m """
+        diff = self.get_diff()
+        ss = self.sum_dd - 2*diff*self.sum_dm + diff*diff*self.sum_mm
+
+        return max(0.0, ss)
+
+    def get_interval(self):
+        """ Returns (low, high) of the score rate difference """
+        diff = self.get_diff()
+        if self.n < 2 or not self.sum_m:
+            return -math.inf, math.inf
+
+        # Variance of the residuals d - diff*m of the ratio estimate with
+        # the prior, |d| is at most maxpoints
+        prior_var = (self.sum_m / self.n / 2) ** 2
+        var = ((self.get_residual_ss() + self.prior_positions * prior_var)
+               / (self.n - 1 + self.prior_positions))
+        n0 = self.min_positions
+        radius = math.sqrt(var * (self.n + n0) * math.log(
+                (self.n + n0) / (n0 * self.alpha**2))) / self.sum_m
+
+        return diff - radius, diff + radius
+
+    def get_decision(self):
+        """ Returns 'better', 'worse', 'negligible' for engine 1 against
+            engine 2 or None if more positions are needed
+        """
+        if self.n < self.min_positions:
+            return None
+        low, high = self.get_interval()
+        if low > 0:
+            return 'better'
+        if high < 0:
+            return 'worse'
+        # Engines that never differed are not known to be close
+        if (low > -self.margin and high < self.margin
+                and self.get_residual_ss() > 0):
+            return 'negligible'
+
+        return None
+
+
+def run_sequential_test(analyses, test):
+    """ Analyze the positions with the two engines of analyses one position
+        at a time and stop when test has a decision, returns the decision
+        or 'inconclusive' if all positions are analyzed
+    """
+    a1, a2 = analyses
+    procs = []
+    searched = [{}, {}]  # {position key: result} per engine
+    decision = None
+    try:
+        for a in analyses:
+            procs.append(a.start_uci_engine())
+
+        for i, fen_line in enumerate(a1.fen_list):
+            logger.info('\n')
+            logger.info('Pos %d' % (i+1))
+            logger.info('EPD: %s' % fen_line[3])
+            print('epd %d / %d \r' % (i+1, a1.max_epd_cnt)),
+
+            points = []
+            for a, p, cache in zip(analyses, procs, searched):
+                key = a.get_search_key(i)
+                result = cache.get(key)
+                if result is None:
+                    result = a.search_uci_position(p, fen_line[0], a.movetime)
+                    cache[key] = result
+                else:
+                    result = dict(result, elapsed=0)
+                a.num_pos_tried += 1
+                points.append(a.update_score(fen_line[4], result['bm']))
+                a.save_position_result(fen_line, result, points[-1])
+                a.write_epd_output(fen_line[0], result, i+1)
+                if a.progress is not None:
+                    a.progress.update(a, result['nps'])
+
+            test.update(points[0], points[1],
+                        fen_line[4][0][1] if fen_line[4] else 0)
+            low, high = test.get_interval()
+            logger.info('Score rate difference: %0.4f [%0.4f, %0.4f]' % (
+                    test.get_diff(), low, high))
+            decision = test.get_decision()
+            if decision is not None:
+                break
+    finally:
+        # Quit the engines that were started
+        for a, p in zip(analyses, procs):
+            a.quit_engine(p)
+
+    decision = decision or 'inconclusive'
+    logger.info('Sequential test after %d positions: %s' % (
+            test.n, get_decision_text([a1.name, a2.name], decision)))
+
+    return decision
+
+
+def get_decision_text(names, decision):
+    """ Returns the sequential test decision of names[0] against names[1] as text """
+    if decision == 'better':
+        return '%s is better' % names[0]
+    if decision == 'worse':
+        return '%s is better' % names[1]
+    if decision == 'negligible':
+        return 'difference is within the margin'
+
+    return 'inconclusive, all positions are analyzed'
+
+
+def write_sequential_test_summary(out_fn, names, test, decision):
+    """ Append the sequential test result to the text summary """
+    low, high = test.get_interval()
+    with open(out_fn, 'a') as f:
+        f.write('\nD. Sequential test\n')
+        f.write('Engines        : %s vs %s\n' % tuple(names))
+        f.write('Positions      : %d\n' % test.n)
+        f.write('Alpha          : %s\n' % test.alpha)
+        f.write('Margin         : %0.3f\n' % test.margin)
+        f.write('ScoreRateDiff  : %0.4f [%0.4f, %0.4f]\n' % (
+                test.get_diff(), low, high))
+        f.write('Decision       : %s\n' % get_decision_text(names, decision))
+
+
+def write_group_results_in_csv(group_csv_fn, engine_name, group_data,
+                               ana_time, engine_numhash, engine_numthreads):
+    """ Write results by group, group_data is a list of
+        [group, top1cnt, score, maxscore, numpostried]
+    """
+    if not os.path.isfile(group_csv_fn):
+        with open(group_csv_fn, 'a') as f:
+            f.write('%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s\n' % ('Engine', 'Group',
+                    'Top1', 'MaxTop1', 'Top1Rate', 'Score', 'MaxScore',
+                    'ScoreRate', 'MoveTime(ms)', 'Hash(MB)', 'Threads'))
+
+    with open(group_csv_fn, 'a') as f:
+        for group, top1_cnt, total_score, max_score, epd_cnt_tried in group_data:
+            top1_rate, score_rate = get_rates(top1_cnt, epd_cnt_tried,
+                                              total_score, max_score)
+            # The group is quoted as it may have a comma
+            f.write('%s,"%s",%d,%d,%0.3f,%d,%d,%0.3f,%d,%d,%d\n' % (engine_name,
+                    group.replace('"', "'"), top1_cnt, epd_cnt_tried, top1_rate,
+                    total_score, max_score, score_rate, ana_time,
+                    engine_numhash, engine_numthreads))
+
+
+def write_results(output_summary_fn, ana_data, engine_numthreads,
+                  engine_numhash, ana_time, input_epd_fn, good_epd_cnt,
+                  group_data=None, placement=None, num_duplicates=None):
+    """ Write results in text, csv and html files
+
+    group_data: [(engine, [[group, top1cnt, score, maxscore, numpostried], ...]), ...]
+    """
+    csv_fn = output_summary_fn[0:-4] + '.csv'
+    html_fn = output_summary_fn[0:-4] + '.html'
+    group_csv_fn = None
+    input_epd_file = os.path.basename(input_epd_fn)
+
+    # Ranked table for the html, unique per call so that runs from the
+    # same folder do not overwrite each other
+    fd, temp_csv_fn = tempfile.mkstemp(suffix='.csv')
+    os.close(fd)
+
+    write_results_summary(output_summary_fn, ana_data, engine_numthreads,
+                          engine_numhash, ana_time, input_epd_fn, input_epd_file,
+                          good_epd_cnt, placement, num_duplicates)
+    write_results_in_csv(csv_fn, ana_data, ana_time, engine_numhash,
+                         engine_numthreads, temp_csv_fn)
+
+    if group_data:
+        group_csv_fn = output_summary_fn[0:-4] + '_groups.csv'
+        for engine_name, rows in group_data:
+            write_group_results_in_csv(group_csv_fn, engine_name, rows, ana_time,
+                                       engine_numhash, engine_numthreads)
+
+    delete_file(html_fn)        
+    csv_to_html(temp_csv_fn, html_fn, input_epd_fn, group_csv_fn)
+    delete_file(temp_csv_fn)
+
+
+def parse_epd_lines(epd_lines, require_solutions=True):
+    """ Returns a fen list of epd lines in memory, lines that can not be
+        used are skipped
+    """
+    fen_list = []
+    for line in epd_lines:
+        if line.strip():
+            fen_line = parse_epd_line(line, require_solutions)
+            if fen_line is not None:
+                fen_list.append(fen_line)
+
+    return fen_list
+
+
+def create_analyze(config, fen_list):
+    """ Returns Analyze of fen_list from an engine config dict, no file
+        is written while it runs
+
+    config keys, only engine is required:
+      engine, name, threads=1, hash=64, movetime=500, protocol='uci',
+      options={'MultiPV': 4, ...}, timebudget (seconds, uci only),
+      dedup=True, affinity, numa_node, san, stmode, protover, infinite,
+      runenginefromcwd
+    """
+    engine = config['engine']
+    options = config.get('options') or {}
+    multipv = 1
+    for name, value in options.items():
+        if name.lower() == 'multipv':
+            multipv = int(value)
+    eoption = ', '.join('%s=%s' % (k, v) for k, v in options.items()) or None
+
+    movetime = config.get('movetime', 500)
+    timebudget_ms = None
+    if config.get('timebudget') is not None:
+        if config.get('protocol', 'uci') == 'xboard':
+            raise ValueError('timebudget is only supported for uci engines')
+        timebudget_ms = int(config['timebudget'] * 1000)
+        movetime = timebudget_ms // max(1, len(fen_list))
+
+    pos_keys = None
+    if config.get('dedup', True):
+        pos_keys = plan_unique_positions(fen_list)[0]
+
+    return Analyze(engine, fen_list, len(fen_list), movetime,
+                   config.get('threads', 1), config.get('hash', 64),
+                   config.get('protocol', 'uci'),
+                   config.get('name', Path(engine).stem), config.get('san', 0),
+                   config.get('stmode', 1), config.get('protover', 2), None,
+                   multipv, eoption, '', config.get('infinite', False),
+                   config.get('runenginefromcwd', False), None,
+                   config.get('affinity'), config.get('numa_node'), pos_keys,
+                   None, timebudget_ms)
+
+
+def iter_analysis(fen_list, config):
+    """ Analyze fen_list with the engine of config and yield the result
+        dict of each position with the engine name added
+    """
+    a = create_analyze(config, fen_list)
+    for result in a.iter_positions():
+        yield dict(result, engine=a.name)
+
+
+def iter_analyses(fen_list, configs, max_workers=None):
+    """ Analyze fen_list with each engine config concurrently and yield
+        the position results in the order they are ready
+
+    Every engine runs in its own thread, at most max_workers engines run
+    at the same time. Closing the iteration early quits the engines.
+    """
+    max_workers = max_workers or len(configs)
+    results = queue.Queue(maxsize=max_workers * 4)
+    stop = threading.Event()
+    slots = threading.Semaphore(max_workers)
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def worker(config):
+        with slots:
+            if stop.is_set():
+                put(done)
+                return
+            it = iter_analysis(fen_list, config)
+            try:
+                for result in it:
+                    if not put(result):
+                        break
+            except Exception as e:
+                put(e)
+            finally:
+                it.close()
+                put(done)
+
+    threads = [threading.Thread(target=worker, args=(c,), daemon=True)
+               for c in configs]
+    for t in threads:
+        t.start()
+
+    try:
+        num_done = 0
+        while num_done < len(threads):
+            item = results.get()
+            if item is done:
+                num_done += 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+
+
+def parse_int_list(value):
+    """ Convert '1,2,4' to [1, 2, 4] """
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def parse_positive_int(value):
+    """ Convert '4' to 4, it should be 1 or more """
+    try:
+        n = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('{} is not a number'.format(value))
+    if n < 1:
+        raise argparse.ArgumentTypeError('{} should be 1 or more'.format(value))
+
+    return n
+
+
+def parse_port(value):
+    """ Convert '9100' to 9100, it should be 0 to 65535 """
+    try:
+        port = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('{} is not a number'.format(value))
+    if not 0 <= port <= 65535:
+        raise argparse.ArgumentTypeError('port {} should be 0 to 65535'.format(value))
+
+    return port
+
+
+def parse_regex(value):
+    """ Compile regex value """
+    try:
+        return re.compile(value)
+    except re.error as e:
+        raise argparse.ArgumentTypeError('invalid regex {}: {}'.format(value, e))
+
+
+def parse_shard(value):
+    """ Convert 'k/n' to (k, n) """
+    try:
+        k, n = [int(v) for v in value.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('shard should be k/n like 2/4')
+    if not 1 <= k <= n:
+        raise argparse.ArgumentTypeError('shard k/n should have 1 <= k <= n')
+
+    return k, n
+
+
 def main():
     parser = argparse.ArgumentParser(description=APP_DESC, epilog=APP_NAME_VERSION)
     parser.add_argument('-i', '--epd', help='input epd filename', required=True)
     parser.add_argument('-o', '--output', default='mea_results.txt',
                         help='text output filename for result, default=mea_results.txt')
-    parser.add_argument('-e', '--engine', help='engine filename', required=True)
+    parser.add_argument('-e', '--engine', help='engine filename')
     parser.add_argument('--eoption', 
        help='uci engine option, --eoption "contempt=true, ' +
        'Futility Pruning=false, pawn value=120"', required=False)
-    parser.add_argument('-n', '--name', help='engine name', required=True)
+    parser.add_argument('-n', '--name', help='engine name')
     parser.add_argument('-t', '--threads', default=1,
                         help='Threads or cores to be used by the engine, ' +
                         'default=1.', type=int)
@@ -898,6 +3066,9 @@ def main():
             help='Hash in MB to be used by the engine, default=64.', type=int)
     parser.add_argument('-a', '--movetime', default=500,
         help='Analysis time in milliseconds, 1s = 1000ms, default=500', type=int)
+    parser.add_argument('--timebudget', help='uci engines, total analysis ' +
+        'time in seconds for all positions, difficult positions get more ' +
+        'time, --movetime is not used', type=float)
     parser.add_argument('-r', '--rating', default=2500, 
         help='You may input a rating for this engine, this will be shown ' +
         'in the output file, default=2500', type=int)
@@ -919,10 +3090,121 @@ def main():
                         action='store_true')
     parser.add_argument('--runenginefromcwd', help='Run engine from mea folder',
                         action='store_true')
+    parser.add_argument('--groupprefix', help='Show results by group, the ' +
+        'group is the epd id without the trailing number', action='store_true')
+    parser.add_argument('--groupregex', help='Show results by group, the ' +
+        'group is the first regex group or the match in epd id, ' +
+        '--groupregex "^STS\\S* (\\w+)"', type=parse_regex)
+    parser.add_argument('--groupfile', help='Show results by group, from a ' +
+        'csv file with lines id,group')
+    parser.add_argument('--start', help='First line number of the input ' +
+        'epd to analyze, default=1', type=parse_positive_int)
+    parser.add_argument('--end', help='Last line number of the input ' +
+        'epd to analyze, default=last line', type=parse_positive_int)
+    parser.add_argument('--stride', default=1, help='Analyze every ' +
+        'stride line from --start, default=1', type=parse_positive_int)
+    parser.add_argument('--shard', help='Analyze the k-th of n shards of ' +
+        'the selected lines, --shard 2/4', type=parse_shard)
+    parser.add_argument('--nodedup', help='Search duplicate positions ' +
+        'again, by default a position is searched once and its result is ' +
+        'used for its duplicates', action='store_true')
+    parser.add_argument('--affinity', help='Linux only, run the engine on ' +
+        'these cpus, --affinity "0-3,8"', type=parse_cpu_list)
+    parser.add_argument('--numanode', help='Linux only, run the engine on ' +
+        'the cpus of this numa node, memory is bound to the node if ' +
+        'numactl is installed', type=int)
+    parser.add_argument('--sweepthreads', help='Run the engine for each ' +
+        'threads value, --sweepthreads "1,2,4,8"', type=parse_int_list)
+    parser.add_argument('--sweephash', help='Run the engine for each ' +
+        'hash value, --sweephash "64,256"', type=parse_int_list)
+    parser.add_argument('--sweepmovetime', help='Run the engine for each ' +
+        'movetime value, --sweepmovetime "500,1000"', type=parse_int_list)
+    parser.add_argument('--maxcpus', help='for sweep, max number of cpus ' +
+        'to use, default=all', type=parse_positive_int)
+    parser.add_argument('--maxmemory', help='for sweep, max memory in mb ' +
+        'to use for engine hash, default=75%% of physical memory', type=int)
+    parser.add_argument('--export', help='Save per position results ' +
+        'to this file, parquet if it ends with .parquet and pyarrow is ' +
+        'installed, otherwise a packed columnar file')
+    parser.add_argument('--report', metavar='REPORT_DIR', help='Save an ' +
+        'html report with engine ranking, charts and the move of each ' +
+        'engine per position to REPORT_DIR/index.html')
+    parser.add_argument('--reportfrom', nargs='+', metavar='EXPORT_FILE',
+        help='for --report, add the position results of these --export ' +
+        'files, no engine is run if --engine is not given')
+    parser.add_argument('--metricsport', help='Serve progress metrics in ' +
+        'Prometheus text format at http://127.0.0.1:[port]/metrics',
+        type=parse_port)
+    parser.add_argument('--metricsfile', help='Write progress metrics in ' +
+        'Prometheus text format to this file')
+    parser.add_argument('--metricsinterval', default=5.0, help='Seconds ' +
+        'between writes of --metricsfile, default=5', type=float)
+    parser.add_argument('--generate', metavar='OUTPUT_EPD', help='Analyze ' +
+        'the input epd with --engine as reference engine in multipv and save ' +
+        'the positions with c0 solution points, bm, acd and Ae to this file')
+    parser.add_argument('--genmultipv', default=7, help='for --generate, ' +
+        'number of moves to analyze if multipv is not in --eoption, default=7',
+        type=int)
+    parser.add_argument('--workers', default=1, help='for --generate, ' +
+        'number of engines to run in parallel, default=1', type=int)
+    parser.add_argument('--genformula', default='linear',
+        choices=['linear', 'exp'], help='for --generate, points of a move ' +
+        'from its score gap to the best move, linear: 100 - gap/scale, ' +
+        'exp: 100*exp(-gap/scale), default=linear')
+    parser.add_argument('--genscale', default=GENERATE_SCALE,
+        help='for --generate, scale in cp of --genformula, ' +
+        f'default={GENERATE_SCALE:g}', type=float)
+    parser.add_argument('--genminpoints', default=1, help='for --generate, ' +
+        'moves with less points are not included, default=1', type=int)
+    parser.add_argument('--engine2', help='uci engines, compare --engine ' +
+        'with this engine on the same random order of positions and stop ' +
+        'when the score rate difference is significant or negligible')
+    parser.add_argument('--name2', help='for --engine2, engine name')
+    parser.add_argument('--eoption2', help='for --engine2, uci engine ' +
+        'option like --eoption')
+    parser.add_argument('--rating2', help='for --engine2, rating of the ' +
+        'engine, default=--rating', type=int)
+    parser.add_argument('--seed', help='for --engine2, seed of the random ' +
+        'order of positions, default=random', type=int)
+    parser.add_argument('--alpha', default=0.05, help='for --engine2, ' +
+        'error rate of the test, default=0.05', type=float)
+    parser.add_argument('--margin', default=0.02, help='for --engine2, ' +
+        'score rate difference that is negligible, default=0.02', type=float)
+    parser.add_argument('--minpositions', default=100, help='for --engine2, ' +
+        'number of positions before the test can stop, default=100', type=int)
+    parser.add_argument('--rescore', nargs='+', metavar='EPD_OUT',
+        help='Score saved epd outputs of mea against the solutions in --epd ' +
+        'without running the engine, engine name is taken from the ' +
+        'filename [epd name]_[engine name].epd or from --name')
+    parser.add_argument('--baseepd', help='for --rescore, epd with the old ' +
+        'solutions to report the positions that were changed in --epd')
     parser.add_argument('--version', '-V', action='version', version=f"{__version__}")
 
     # Get values from arguments    
     args = parser.parse_args()
+    is_report_only = args.reportfrom and args.engine is None
+    if args.reportfrom and not args.report:
+        parser.error('--reportfrom requires --report')
+    if args.start is not None and args.end is not None and args.start > args.end:
+        parser.error('--start should not be after --end')
+    if (not args.rescore and not is_report_only
+            and (args.engine is None or args.name is None)):
+        parser.error('the following arguments are required: -e/--engine, -n/--name')
+    if args.engine2 is not None:
+        if args.name2 is None:
+            parser.error('--engine2 requires --name2')
+        if args.protocol != 'uci':
+            parser.error('--engine2 is only supported for uci engines')
+        if (args.sweepthreads or args.sweephash or args.sweepmovetime
+                or args.timebudget or args.generate):
+            parser.error('--engine2 cannot be used with sweep, --timebudget '
+                         'or --generate')
+    if args.timebudget and (args.sweepthreads or args.sweephash
+                            or args.sweepmovetime):
+        parser.error('--timebudget cannot be used with sweep')
+    if args.timebudget and args.generate:
+        parser.error('--timebudget cannot be used with --generate')
+
     input_epd_fn = args.epd  # Can have path like .\epd\test.epd
     output_summary_fn = args.output
     engine_fn = args.engine
@@ -935,8 +3217,6 @@ def main():
     
     ana_data = []
     multipv = 1
-    csv_fn = output_summary_fn[0:-4] + '.csv'
-    html_fn = output_summary_fn[0:-4] + '.html'
     
     # If there is engine options in command line, find the hash and threads
     # value, we will use this as info in csv and html table
@@ -956,12 +3236,58 @@ def main():
     # Prepare filenames
     input_epd_file = os.path.basename(args.epd) # filename alone with extension
     input_epd_name = input_epd_file[0:-4]  # filename alone without extension
+
+    group_map = read_group_file(args.groupfile) if args.groupfile else None
+    is_grouped = args.groupprefix or args.groupregex or group_map is not None
+
+    # Html report of exported position results, no engine is run
+    if is_report_only:
+        fen_list, _, _ = create_epd_list(input_epd_fn, args.start, args.end,
+                                         args.stride, args.shard)
+        write_report(args.report, None, args.reportfrom, input_epd_fn, fen_list)
+        return
+
+    # Score saved epd outputs, no engine is run
+    if args.rescore:
+        fen_list, good_epd_cnt, _ = create_epd_list(
+                input_epd_fn, args.start, args.end, args.stride, args.shard)
+        group_keys = None
+        if is_grouped:
+            group_keys = create_group_keys(fen_list, args.groupprefix,
+                                           args.groupregex, group_map)
+        base_fen_list = None
+        if args.baseepd:
+            base_fen_list, _, _ = create_epd_list(args.baseepd)
+
+        if args.name and len(args.rescore) == 1:
+            engine_names = [args.name]
+        else:
+            epd_names = [input_epd_name]
+            if args.baseepd:
+                epd_names.append(Path(args.baseepd).stem)
+            engine_names = [get_engine_name_from_output(fn, epd_names)
+                            for fn in args.rescore]
+
+        ana_data, group_data = rescore_epd_outputs(
+                fen_list, args.rescore, engine_names, engine_rating,
+                base_fen_list, group_keys)
+
+        # Settings of the saved outputs are not known, they are 0
+        write_results(output_summary_fn, ana_data, 0, 0, 0, input_epd_fn,
+                      good_epd_cnt, group_data)
+        return
     
+    # Time of the run in filenames, movetime or the time budget as the
+    # movetime per position is only known after the epd is read
+    time_tag = 'mt{}ms'.format(ana_time)
+    if args.timebudget:
+        time_tag = 'tb{:g}s'.format(args.timebudget)
+
     # Only create log file if there is --log
     if args.log:
         # Declare log filename and replace forward, backward, and empty chars with underscore
-        log_fn = '{}_multipv{}_{}_mt{}ms_log.txt'.format(input_epd_name, multipv,
-                         args.name, ana_time)
+        log_fn = '{}_multipv{}_{}_{}_log.txt'.format(input_epd_name, multipv,
+                         args.name, time_tag)
         for r in ((' ', '_'), ('/', '_'), ('\\', '_')):
             log_fn = log_fn.replace(*r)
         
@@ -969,31 +3295,275 @@ def main():
         formatter = logging.Formatter('[%(asctime)24s - %(levelname)8s ] %(message)s')
         fh.setFormatter(formatter)
         logger.addHandler(fh)
+    else:
+        # Debug and info messages of engine output are not saved
+        logger.setLevel(logging.WARNING)
 
     # Declare epd output filename (saving bm, ce and acd) and replace other chars in it
     if multipv > 1:
-        epd_output_fn = '{}_multipv{}_{}_mt{}ms_epd.epd'.format(
-                input_epd_name, multipv, args.name, ana_time)
+        epd_output_fn = '{}_multipv{}_{}_{}_epd.epd'.format(
+                input_epd_name, multipv, args.name, time_tag)
     else:
         epd_output_fn = '{}_{}.epd'.format(input_epd_name, args.name)
     for r in ((' ', '_'), ('/', '_'), ('\\', '_')):
         epd_output_fn = epd_output_fn.replace(*r)
     delete_file(epd_output_fn)
     
+    # Create epd with solution points from multipv analysis of a reference engine
+    if args.generate:
+        if proto != 'uci':
+            parser.error('--generate is only supported for uci engines')
+        gen_multipv, gen_eoption = multipv, eoption
+        if multipv <= 1:
+            gen_multipv = args.genmultipv
+            gen_eoption = ', '.join(filter(None, [eoption, f'MultiPV={gen_multipv}']))
+
+        fen_list, _, _ = create_epd_list(args.epd, args.start, args.end,
+                                         args.stride, args.shard,
+                                         require_solutions=False)
+        cpus = get_available_cpus()
+
+        def create_worker_analyze(chunk, k):
+            # Pin each worker to its own cpus if there are enough
+            worker_cpus = None
+            if len(cpus) >= args.workers * engine_numthreads:
+                worker_cpus = cpus[k*engine_numthreads:(k+1)*engine_numthreads]
+            chunk_keys = None if args.nodedup else plan_unique_positions(chunk)[0]
+            return Analyze(engine_fn, chunk, len(chunk), ana_time,
+                           engine_numthreads, engine_numhash, proto, args.name,
+                           args.san, args.stmode, args.protover, None,
+                           gen_multipv, gen_eoption, input_epd_name,
+                           args.infinite, args.runenginefromcwd, None,
+                           worker_cpus, None, chunk_keys)
+
+        pos_results = run_generate(create_worker_analyze, fen_list, args.workers)
+        write_generated_epd(args.generate, fen_list, pos_results, args.name,
+                            args.genformula, args.genscale, args.genminpoints)
+        logger.info('Done!!')
+        logging.shutdown()
+        if args.log:
+            move_file('log', log_fn)
+        return
+    
     # Covert epd file to a list
-    fen_list, good_epd_cnt, total_epd_cnt = create_epd_list(args.epd)
+    fen_list, good_epd_cnt, total_epd_cnt = create_epd_list(
+            args.epd, args.start, args.end, args.stride, args.shard)
     if good_epd_cnt != total_epd_cnt:
         logger.warning('Total positions in the input epd are not being considered.')
+
+    # Engines are compared on the same random order of positions
+    if args.engine2:
+        seed = args.seed if args.seed is not None else random.randrange(2**32)
+        random.Random(seed).shuffle(fen_list)
+        logger.info('Position order seed: %d' % seed)
+        print('Position order seed: %d' % seed)
+
+    group_keys = None
+    if is_grouped:
+        group_keys = create_group_keys(fen_list, args.groupprefix,
+                                       args.groupregex, group_map)
+
+    # Duplicate positions are searched once
+    pos_keys, num_duplicates = None, None
+    if not args.nodedup:
+        pos_keys, num_duplicates = plan_unique_positions(fen_list)
+        if num_duplicates:
+            logger.info('Duplicate positions: %d' % num_duplicates)
+            print('Duplicate positions: %d' % num_duplicates)
+        
+    # Progress metrics for monitoring
+    exporter = None
+    if args.metricsport is not None or args.metricsfile:
+        exporter = MetricsExporter()
+        if args.metricsport is not None:
+            exporter.serve_http(args.metricsport)
+        if args.metricsfile:
+            exporter.write_file_periodically(args.metricsfile, args.metricsinterval)
+
+    # Average time per position is used as movetime in the results
+    timebudget_ms = None
+    if args.timebudget:
+        if proto != 'uci':
+            parser.error('--timebudget is only supported for uci engines')
+        timebudget_ms = int(args.timebudget * 1000)
+        ana_time = timebudget_ms // max(1, good_epd_cnt)
+
+        # Every position is searched at least TIME_BUDGET_MIN_PROBE_MS
+        min_ms = (good_epd_cnt - (num_duplicates or 0)) * TIME_BUDGET_MIN_PROBE_MS
+        if min_ms > timebudget_ms:
+            msg = ('Warning, the time budget is too small, all positions '
+                   'need at least {:0.1f}s'.format(min_ms / 1000))
+            logger.warning(msg)
+            print(msg)
+
+    # Engine placement on cpus and numa node
+    numa_nodes = get_numa_nodes()
+    affinity = args.affinity
+    if affinity is not None:
+        unavailable = set(affinity) - set(get_available_cpus())
+        if not affinity:
+            parser.error('--affinity has no cpus')
+        if unavailable:
+            parser.error('--affinity cpus {} are not available, cpus: {}'.format(
+                    format_cpus(unavailable), format_cpus(get_available_cpus())))
+    if args.numanode is not None:
+        if args.numanode not in numa_nodes:
+            parser.error('numa node {} is not available, nodes: {}'.format(
+                    args.numanode, list(numa_nodes)))
+        node_cpus = numa_nodes[args.numanode]
+        affinity = [c for c in affinity if c in node_cpus] if affinity else node_cpus
+        if not affinity:
+            parser.error('--affinity has no cpus of numa node {}, node cpus: {}'.format(
+                    args.numanode, format_cpus(node_cpus)))
+        numa_nodes = {args.numanode: affinity}
+    elif affinity:
+        numa_nodes = {node: [c for c in node_cpus if c in affinity]
+                      for node, node_cpus in numa_nodes.items()}
+        numa_nodes = {node: cpus for node, cpus in numa_nodes.items() if cpus}
+    numa_node = None if affinity is None else get_numa_node(affinity, numa_nodes)
+
+    # Run the engine for each threads, hash and movetime in the grid
+    if args.sweepthreads or args.sweephash or args.sweepmovetime:
+        configs = get_sweep_configs(args.sweepthreads or [engine_numthreads],
+                                    args.sweephash or [engine_numhash],
+                                    args.sweepmovetime or [ana_time])
+        cpus = (affinity or get_available_cpus())[0:args.maxcpus]
+        max_memory_mb = args.maxmemory
+        if max_memory_mb is None and get_memory_mb() is not None:
+            max_memory_mb = get_memory_mb() * 3 // 4
+
+        sweep_epd_output_fns = []
+        sweep_analyses = []
+
+        def create_config_analyze(config, config_cpus, node):
+            fn = '{}_{}_th{}_hash{}_mt{}.epd'.format(input_epd_name, args.name,
+                    config['threads'], config['hash'], config['movetime'])
+            for r in ((' ', '_'), ('/', '_'), ('\\', '_')):
+                fn = fn.replace(*r)
+            delete_file(fn)
+            sweep_epd_output_fns.append(fn)
+            progress = None
+            if exporter is not None:
+                progress = exporter.add(Progress({'engine': args.name,
+                        'threads': config['threads'], 'hash': config['hash'],
+                        'movetime': config['movetime']}, good_epd_cnt))
+            a = Analyze(engine_fn, fen_list, good_epd_cnt, config['movetime'],
+                        config['threads'], config['hash'], proto, args.name,
+                        args.san, args.stmode, args.protover, fn, multipv,
+                        eoption, input_epd_name, args.infinite,
+                        args.runenginefromcwd, group_keys, config_cpus, node,
+                        pos_keys, progress)
+            sweep_analyses.append(a)
+            return a
+
+        sweep_data = run_sweep(create_config_analyze, configs, cpus,
+                               max_memory_mb, numa_nodes=numa_nodes)
+        if exporter is not None:
+            exporter.stop()
+        columns = {}
+        for a in sweep_analyses:
+            for name, values in get_result_columns(a).items():
+                columns.setdefault(name, []).extend(values)
+        if args.export:
+            export_results(args.export, columns)
+        if args.report:
+            write_report(args.report, columns, args.reportfrom, input_epd_fn,
+                         fen_list)
+        group_data = None
+        if is_grouped:
+            group_data = {(a.num_threads, a.num_hash, a.movetime):
+                          a.get_group_result() for a in sweep_analyses}
+        write_sweep_results(output_summary_fn, sweep_data, engine_rating,
+                            input_epd_fn, good_epd_cnt, group_data)
+        logger.info('Done!!')
+        logging.shutdown()
+
+        for fn in sweep_epd_output_fns:
+            move_file('epd_out', fn)
+        if args.log:
+            move_file('log', log_fn)
+        return
+
+    # Compare two engines until the test has a decision
+    if args.engine2:
+        epd_output_fn2 = '{}_{}.epd'.format(input_epd_name, args.name2)
+        for r in ((' ', '_'), ('/', '_'), ('\\', '_')):
+            epd_output_fn2 = epd_output_fn2.replace(*r)
+        delete_file(epd_output_fn2)
+
+        engines = [(engine_fn, args.name, eoption, epd_output_fn, engine_rating),
+                   (args.engine2, args.name2, args.eoption2, epd_output_fn2,
+                    args.rating2 or engine_rating)]
+        analyses = []
+        for fn, name, option, out_fn, _ in engines:
+            a = Analyze(fn, fen_list, good_epd_cnt, ana_time, engine_numthreads,
+                        engine_numhash, proto, name, args.san, args.stmode,
+                        args.protover, out_fn, multipv, option, input_epd_name,
+                        args.infinite, args.runenginefromcwd, group_keys,
+                        affinity, numa_node, pos_keys)
+            if exporter is not None:
+                a.progress = exporter.add(Progress({'engine': name, 'threads':
+                        engine_numthreads, 'hash': engine_numhash,
+                        'movetime': ana_time}, good_epd_cnt))
+            analyses.append(a)
+
+        test = SequentialTest(args.alpha, args.margin, args.minpositions)
+        decision = run_sequential_test(analyses, test)
+        if exporter is not None:
+            exporter.stop()
+        columns = {}
+        for a in analyses:
+            for name, values in get_result_columns(a).items():
+                columns.setdefault(name, []).extend(values)
+        if args.export:
+            export_results(args.export, columns)
+        if args.report:
+            write_report(args.report, columns, args.reportfrom, input_epd_fn,
+                         fen_list)
+
+        for a, (_, _, _, _, rating) in zip(analyses, engines):
+            elapsed = sum(r['elapsed_ms'] for r in a.pos_results) / 1000
+            ana_data.append(a.get_result() + [elapsed, rating])
+        group_data = None
+        if is_grouped:
+            group_data = [(a.name, a.get_group_result()) for a in analyses]
+        write_results(output_summary_fn, ana_data, engine_numthreads,
+                      engine_numhash, ana_time, input_epd_fn, good_epd_cnt,
+                      group_data, analyses[0].get_placement() if affinity else None,
+                      num_duplicates)
+        write_sequential_test_summary(output_summary_fn, [args.name, args.name2],
+                                      test, decision)
+        print(get_decision_text([args.name, args.name2], decision))
+        logger.info('Done!!')
+        logging.shutdown()
+
+        move_file('epd_out', epd_output_fn)
+        move_file('epd_out', epd_output_fn2)
+        if args.log:
+            move_file('log', log_fn)
+        return
         
     # Analyze the epd
     a = Analyze(engine_fn, fen_list, good_epd_cnt, ana_time, engine_numthreads,
                  engine_numhash, proto, args.name, args.san, args.stmode,
                  args.protover, epd_output_fn, multipv, eoption, input_epd_name,
-                 args.infinite, args.runenginefromcwd)
+                 args.infinite, args.runenginefromcwd, group_keys,
+                 affinity, numa_node, pos_keys, None, timebudget_ms)
+    if exporter is not None:
+        a.progress = exporter.add(Progress({'engine': args.name, 'threads':
+                engine_numthreads, 'hash': engine_numhash, 'movetime': ana_time},
+                good_epd_cnt))
     
     start_time = time.perf_counter()  # Python v3.3 and up
     a.run()
     end_time = time.perf_counter()
+    if exporter is not None:
+        exporter.stop()
+    if args.export:
+        export_results(args.export, get_result_columns(a))
+    if args.report:
+        write_report(args.report, get_result_columns(a), args.reportfrom,
+                     input_epd_fn, fen_list)
     
     elapsed = end_time - start_time             
     v = a.get_result()  # [engine, top1cnt, score, maxscore, numpostried]
@@ -1001,16 +3571,11 @@ def main():
     v.insert(len(v), engine_rating) # [engine, top1cnt, score, maxscore, numpostried, elapsed, rating]
     ana_data.append(v)
 
-    temp_csv_fn = 'temp_csv_results.csv'
-    write_results_summary(output_summary_fn, ana_data, engine_numthreads,
-                          engine_numhash, ana_time, args.epd, input_epd_file,
-                          good_epd_cnt)
-    write_results_in_csv(csv_fn, ana_data, ana_time, engine_numhash,
-                         engine_numthreads, temp_csv_fn)
-
-    delete_file(html_fn)        
-    csv_to_html(temp_csv_fn, html_fn, input_epd_fn)
-    delete_file(temp_csv_fn)
+    group_data = [(args.name, a.get_group_result())] if is_grouped else None
+    write_results(output_summary_fn, ana_data, engine_numthreads,
+                  engine_numhash, ana_time, input_epd_fn, good_epd_cnt,
+                  group_data, a.get_placement() if affinity else None,
+                  num_duplicates)
     logger.info('Done!!')
     logging.shutdown()
     
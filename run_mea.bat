@@ -51,6 +51,13 @@ python mea.py --engine ".\engines\Deuterium_v2019.1.36.50_x64_pop.exe" ^
 :: --protocol uci --rating 2800 --epd %EPD% --movetime %MT% --output %OUTPUT% --log
 
 
+:: (3) Example of threads and hash scaling sweep, configs are run side by side
+:: as long as their threads fit in the cpus and each engine is pinned to its cpus
+:: python mea.py --engine ".\engines\Deuterium_v2019.1.36.50_x64_pop.exe" ^
+:: --name "Deuterium v2019.1.36.50" --sweepthreads "1,2,4" --sweephash "64,256" ^
+:: --sweepmovetime "500,1000" --rating 2773 --epd %EPD% --output %OUTPUT%
+
+
 ::-----------------------------------------------------------------------------
 
 